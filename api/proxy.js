@@ -16,9 +16,9 @@ const SKIP_REQ_HEADERS = new Set([
     'sec-ch-ua', 'sec-ch-ua-mobile', 'sec-ch-ua-platform',
 ]);
 
-// 不转发的响应头
+// 不转发的响应头（响应体已被 fetch 解压，原长度不再准确）
 const SKIP_RESP_HEADERS = new Set([
-    'content-encoding', 'transfer-encoding', 'connection',
+    'content-encoding', 'transfer-encoding', 'connection', 'content-length',
 ]);
 
 // CORS 响应头
@@ -31,66 +31,104 @@ function corsHeaders() {
     };
 }
 
-export default async function handler(request) {
-    // ── CORS 预检 ──
-    if (request.method === 'OPTIONS') {
-        return new Response(null, { status: 200, headers: corsHeaders() });
-    }
-
-    // ── 解析目标 URL ──
-    const { searchParams } = new URL(request.url);
-    const targetUrl = searchParams.get('url');
-
-    if (!targetUrl) {
-        return new Response(
-            JSON.stringify({ error: { message: '缺少 url 参数' } }),
-            { status: 400, headers: { 'Content-Type': 'application/json', ...corsHeaders() } }
-        );
-    }
-
-    // ── 构建转发请求头 ──
-    const forwardHeaders = new Headers();
-    for (const [key, value] of request.headers.entries()) {
-        if (!SKIP_REQ_HEADERS.has(key.toLowerCase())) {
-            forwardHeaders.set(key, value);
-        }
-    }
-
-    // ── 转发请求 ──
-    try {
-        const fetchOptions = {
-            method: request.method,
-            headers: forwardHeaders,
-        };
-
-        // POST 请求转发请求体
-        if (request.method === 'POST') {
-            fetchOptions.body = await request.arrayBuffer();
+// 等待上游响应头的超时 (毫秒)，可用环境变量 PROXY_UPSTREAM_TIMEOUT_MS 覆盖；
+// 需小于 vercel.json 中的 maxDuration，才能返回干净的 504 而不是被平台强制中断
+const DEFAULT_UPSTREAM_TIMEOUT_MS = 25000;
+
+function jsonError(status, message) {
+    return new Response(
+        JSON.stringify({ error: { message } }),
+        { status, headers: { 'Content-Type': 'application/json', ...corsHeaders() } }
+    );
+}
+
+/**
+ * 创建代理处理函数。fetchImpl 与 timeoutMs 可注入，便于在本地 Node 中用假 fetch 测试：
+ *   const handler = createHandler({ fetchImpl: fakeFetch, timeoutMs: 100 });
+ *   const resp = await handler(new Request('http://x/api/proxy?url=...'));
+ */
+export function createHandler({
+    fetchImpl = (...args) => fetch(...args),
+    timeoutMs = Number(globalThis.process?.env?.PROXY_UPSTREAM_TIMEOUT_MS) || DEFAULT_UPSTREAM_TIMEOUT_MS,
+} = {}) {
+    return async function handler(request) {
+        // ── CORS 预检 ──
+        if (request.method === 'OPTIONS') {
+            return new Response(null, { status: 200, headers: corsHeaders() });
         }
 
-        const resp = await fetch(targetUrl, fetchOptions);
+        // ── 解析目标 URL ──
+        const { searchParams } = new URL(request.url);
+        const targetUrl = searchParams.get('url');
 
-        // ── 构建响应头 ──
-        const responseHeaders = new Headers(corsHeaders());
-        for (const [key, value] of resp.headers.entries()) {
-            if (!SKIP_RESP_HEADERS.has(key.toLowerCase())) {
-                responseHeaders.set(key, value);
+        if (!targetUrl) {
+            return jsonError(400, '缺少 url 参数');
+        }
+
+        // ── 构建转发请求头 ──
+        const forwardHeaders = new Headers();
+        for (const [key, value] of request.headers.entries()) {
+            if (!SKIP_REQ_HEADERS.has(key.toLowerCase())) {
+                forwardHeaders.set(key, value);
             }
         }
 
-        // ── 返回响应 ──
-        return new Response(await resp.arrayBuffer(), {
-            status: resp.status,
-            headers: responseHeaders,
-        });
-
-    } catch (err) {
-        return new Response(
-            JSON.stringify({ error: { message: `代理请求失败: ${err.message}` } }),
-            {
-                status: 502,
-                headers: { 'Content-Type': 'application/json', ...corsHeaders() },
+        // ── 中止控制：浏览器取消请求或等待超时都会中止上游请求，不再消耗配额 ──
+        const controller = new AbortController();
+        const onClientAbort = () => controller.abort(request.signal.reason);
+        if (request.signal) {
+            if (request.signal.aborted) onClientAbort();
+            else request.signal.addEventListener('abort', onClientAbort, { once: true });
+        }
+        let timedOut = false;
+        const timer = setTimeout(() => {
+            timedOut = true;
+            controller.abort();
+        }, timeoutMs);
+
+        // ── 转发请求 ──
+        try {
+            const fetchOptions = {
+                method: request.method,
+                headers: forwardHeaders,
+                signal: controller.signal,
+            };
+
+            // POST 请求体以流的形式直接转发，不在内存中缓冲
+            if (request.method === 'POST' && request.body) {
+                fetchOptions.body = request.body;
+                fetchOptions.duplex = 'half';
             }
-        );
-    }
+
+            const resp = await fetchImpl(targetUrl, fetchOptions);
+            clearTimeout(timer);  // 已收到响应头，流式响应体不受超时限制
+
+            // ── 构建响应头 ──
+            const responseHeaders = new Headers(corsHeaders());
+            for (const [key, value] of resp.headers.entries()) {
+                if (!SKIP_RESP_HEADERS.has(key.toLowerCase())) {
+                    responseHeaders.set(key, value);
+                }
+            }
+
+            // ── 返回响应（直接透传响应体流，SSE 逐块到达浏览器，不在内存中缓冲）──
+            return new Response(resp.body, {
+                status: resp.status,
+                headers: responseHeaders,
+            });
+
+        } catch (err) {
+            clearTimeout(timer);
+            if (timedOut) {
+                return jsonError(504, `上游响应超时 (${timeoutMs / 1000}s)`);
+            }
+            if (request.signal?.aborted) {
+                // 浏览器已断开，返回内容不会被读取
+                return new Response(null, { status: 499, headers: corsHeaders() });
+            }
+            return jsonError(502, `代理请求失败: ${err.message}`);
+        }
+    };
 }
+
+export default createHandler();
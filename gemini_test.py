@@ -7,11 +7,19 @@ AI API 密钥全能测试工具 v4.0
 
 import json
 import sys
+import gzip
+import zlib
+import datetime
+import hashlib
 import time
 import os
 import ssl
 import socket
+import sqlite3
+import threading
 import urllib.request
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 # ─── 依赖检查 ───────────────────────────────────────────────
 
@@ -56,6 +64,79 @@ if sys.platform == "win32":
 def c(text, color):
     return f"{color}{text}{C.RESET}"
 
+# ─── 无头模式与事件流 ─────────────────────────────────────────
+
+HEADLESS = False        # 无头模式: 不等待任何输入，不输出颜色与进度条
+_event_stream = None    # --json-stream 模式下 NDJSON 事件的输出流
+_event_lock = threading.Lock()
+_event_local = threading.local()  # 当前线程的事件接收者 (Web 服务端运行流水线时使用)
+
+
+def enable_headless(json_stream=False):
+    """开启无头模式。json_stream=True 时 stdout 只输出 NDJSON 事件，
+    其余人类可读的输出全部转到 stderr。"""
+    global HEADLESS, _event_stream
+    HEADLESS = True
+    for name in vars(C).copy():
+        if name.isupper():
+            setattr(C, name, "")
+    if json_stream:
+        _event_stream = sys.stdout
+        sys.stdout = sys.stderr
+
+
+def emit_event(event, **fields):
+    """输出一行 NDJSON 事件 (仅 --json-stream 模式，线程安全)；
+    当前线程处于 capture_events 中时改为交给该线程的接收者"""
+    sink = getattr(_event_local, "sink", None)
+    if _event_stream is None and sink is None:
+        return
+    record = {"event": event, "time": round(time.time(), 3)}
+    record.update(fields)
+    if sink is not None:
+        sink(record)
+        return
+    with _event_lock:
+        _event_stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+        _event_stream.flush()
+
+
+class _ThreadQuietStream:
+    """包装 stdout：处于 capture_events 中的线程写入的内容被丢弃，其余线程照常输出"""
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def write(self, text):
+        if getattr(_event_local, "sink", None) is not None:
+            return len(text)
+        return self._stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+@contextmanager
+def capture_events(sink):
+    """在当前线程内把 emit_event 的事件交给 sink(record)，并屏蔽该线程的终端输出。
+    用于在 Web 服务端运行与 CLI 相同的流水线，把进度推送给浏览器。"""
+    with _event_lock:
+        if not isinstance(sys.stdout, _ThreadQuietStream):
+            sys.stdout = _ThreadQuietStream(sys.stdout)
+    previous = getattr(_event_local, "sink", None)
+    _event_local.sink = sink
+    try:
+        yield
+    finally:
+        _event_local.sink = previous
+
+
+def ask(prompt, default=""):
+    """读取用户输入；无头模式下不提示，直接返回默认值"""
+    if HEADLESS:
+        return default
+    return input(prompt)
+
 # ─── 工具函数 ───────────────────────────────────────────────
 
 def fmt_tokens(num):
@@ -67,7 +148,19 @@ def fmt_tokens(num):
         return f"{num // 1_000}K"
     return str(num)
 
+def percentile(values, pct):
+    """计算百分位数 (线性插值)，空列表返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
 def progress_bar(current, total, width=30, label=""):
+    if HEADLESS:
+        return
     filled = int(width * current / total) if total else 0
     bar = "█" * filled + "░" * (width - filled)
     pct = int(100 * current / total) if total else 0
@@ -75,6 +168,8 @@ def progress_bar(current, total, width=30, label=""):
     sys.stdout.flush()
 
 def clear_line():
+    if HEADLESS:
+        return
     sys.stdout.write("\r" + " " * 100 + "\r")
     sys.stdout.flush()
 
@@ -82,10 +177,11 @@ def divider(char="─", length=62):
     print(c(f"  {char * length}", C.GRAY))
 
 def safe_exit(code=0):
-    """安全退出：暂停等待用户按键，防止窗口闪退"""
+    """安全退出：暂停等待用户按键，防止窗口闪退 (无头模式下直接退出)"""
+    emit_event("exit", code=code)
     print()
     try:
-        input(c("  按回车键退出...", C.GRAY))
+        ask(c("  按回车键退出...", C.GRAY))
     except (EOFError, KeyboardInterrupt):
         pass
     sys.exit(code)
@@ -165,50 +261,202 @@ def detect_provider_by_prefix(api_key):
     return None
 
 
+PROBE_TIMEOUT = 6     # 单个服务商探测超时 (秒)
+PROBE_DEADLINE = 8    # 全部并行探测的总时限 (秒)
+
+
+def _probe_one_provider(provider, api_key):
+    """探测单个服务商的 /models 端点，返回 (是否匹配, 状态文本, 状态颜色)"""
+    try:
+        resp = _session.get(
+            f"{provider['base_url']}/models",
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=PROBE_TIMEOUT,
+        )
+        if resp.status_code == 200:
+            data = resp.json()
+            if data.get("data") is not None or data.get("models") is not None or data.get("object"):
+                return True, "✓ 匹配!", C.GREEN + C.BOLD
+            return False, "✗ 响应异常", C.YELLOW
+        elif resp.status_code in (401, 403):
+            return False, "✗ 认证失败", C.GRAY
+        elif resp.status_code == 404:
+            return False, "✗ 端点不存在", C.GRAY
+        else:
+            return False, f"✗ HTTP {resp.status_code}", C.GRAY
+    except requests.exceptions.Timeout:
+        return False, "✗ 超时", C.GRAY
+    except requests.exceptions.ConnectionError:
+        return False, "✗ 连接失败", C.GRAY
+    except Exception as e:
+        return False, f"✗ {str(e)[:30]}", C.GRAY
+
+
+def race_probe_providers(api_key):
+    """同时向所有服务商的 /models 端点发起请求，首个返回有效响应的即为目标，
+    其余探测直接忽略；整体耗时受 PROBE_DEADLINE 限制。
+    返回 (匹配的 PROBE_PROVIDERS 下标或 None, {下标: 探测结果})"""
+    pool = ThreadPoolExecutor(max_workers=len(PROBE_PROVIDERS))
+    futures = {pool.submit(_probe_one_provider, p, api_key): i
+               for i, p in enumerate(PROBE_PROVIDERS)}
+    outcomes = {}
+    matched = None
+    deadline = time.monotonic() + PROBE_DEADLINE
+    pending = set(futures)
+    try:
+        while pending and matched is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for fut in done:
+                idx = futures[fut]
+                outcomes[idx] = fut.result()
+                if outcomes[idx][0] and (matched is None or idx < matched):
+                    matched = idx
+    finally:
+        # 不等待剩余探测，已发出的请求在超时后自行结束
+        pool.shutdown(wait=False, cancel_futures=True)
+    return matched, outcomes
+
+
 def probe_openai_providers(api_key):
-    """探测 sk- 密钥对应的 OpenAI 兼容服务商。
-    逐一尝试各服务商的 /models 端点，首个返回有效响应的即为目标。"""
-    for p in PROBE_PROVIDERS:
+    """探测 sk- 密钥对应的 OpenAI 兼容服务商 (并行竞速，见 race_probe_providers)。
+    状态行按 PROBE_PROVIDERS 的顺序输出。"""
+    sys.stdout.write(c(f"    正在并行探测 {len(PROBE_PROVIDERS)} 个服务商...", C.GRAY))
+    sys.stdout.flush()
+
+    matched, outcomes = race_probe_providers(api_key)
+
+    clear_line()
+    last = matched if matched is not None else len(PROBE_PROVIDERS) - 1
+    for i, p in enumerate(PROBE_PROVIDERS[:last + 1]):
         name = p["name"]
         base_url = p["base_url"]
         domain = base_url.split("//")[1].split("/")[0] if "//" in base_url else base_url
+        if i in outcomes:
+            _, text, color = outcomes[i]
+        elif matched is not None:
+            text, color = "- 已跳过", C.GRAY
+        else:
+            text, color = "✗ 超时", C.GRAY
+        print(f"    尝试 {c(f'{name:<12s}', C.WHITE)} ({c(domain, C.GRAY)})  {c(text, color)}")
 
-        sys.stdout.write(f"    尝试 {c(f'{name:<12s}', C.WHITE)} ({c(domain, C.GRAY)})  ")
-        sys.stdout.flush()
+    return dict(PROBE_PROVIDERS[matched]) if matched is not None else None
 
-        try:
-            resp = _session.get(
-                f"{base_url}/models",
-                headers={"Authorization": f"Bearer {api_key}"},
-                timeout=6,
-            )
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get("data") is not None or data.get("models") is not None or data.get("object"):
-                    print(c("✓ 匹配!", C.GREEN + C.BOLD))
-                    return dict(p)
-                else:
-                    print(c("✗ 响应异常", C.YELLOW))
-            elif resp.status_code in (401, 403):
-                print(c("✗ 认证失败", C.GRAY))
-            elif resp.status_code == 404:
-                print(c("✗ 端点不存在", C.GRAY))
-            else:
-                print(c(f"✗ HTTP {resp.status_code}", C.GRAY))
-        except requests.exceptions.Timeout:
-            print(c("✗ 超时", C.GRAY))
-        except requests.exceptions.ConnectionError:
-            print(c("✗ 连接失败", C.GRAY))
-        except Exception as e:
-            print(c(f"✗ {str(e)[:30]}", C.GRAY))
-    return None
 
+# ─── 服务商识别缓存 ──────────────────────────────────────────
+
+CACHE_DIR = os.environ.get("API_TESTER_CACHE_DIR") or os.path.join(
+    os.path.expanduser("~"), ".api_key_tester")
+DETECT_CACHE_FILE = os.path.join(CACHE_DIR, "provider_cache.json")
+DETECT_CACHE_TTL = 7 * 24 * 3600   # 识别结果缓存 7 天
 
-def auto_detect_provider(api_key, custom_url=None):
+# 缓存中只保存这些字段，绝不保存密钥本身
+_CACHED_PROVIDER_FIELDS = ("name", "icon", "base_url", "format", "needs_proxy_cn")
+
+_cache_lock = threading.Lock()
+
+
+def _load_json_cache(path):
+    """读取 JSON 缓存文件，不存在或损坏时返回空字典"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_json_cache(path, data):
+    """原子写入 JSON 缓存文件，写入失败时静默跳过"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _key_fingerprint(cache, api_key):
+    """用缓存文件内的随机盐对密钥做 SHA-256，缓存中只出现该摘要"""
+    salt = cache.get("salt")
+    if not salt:
+        salt = cache["salt"] = os.urandom(16).hex()
+    return hashlib.sha256(f"{salt}:{api_key}".encode("utf-8")).hexdigest()
+
+
+def load_cached_provider(api_key):
+    """读取密钥对应的已识别服务商，过期或不存在时返回 None"""
+    with _cache_lock:
+        cache = _load_json_cache(DETECT_CACHE_FILE)
+        if not cache.get("salt"):
+            return None
+        entry = cache.get("providers", {}).get(_key_fingerprint(cache, api_key))
+    if not entry or time.time() - entry.get("time", 0) > DETECT_CACHE_TTL:
+        return None
+    provider = dict(entry.get("provider") or {})
+    if not provider.get("base_url"):
+        return None
+    provider["_cached"] = True
+    return provider
+
+
+def save_cached_provider(api_key, provider):
+    """记录密钥 → 服务商的识别结果，同时清理已过期的条目"""
+    with _cache_lock:
+        cache = _load_json_cache(DETECT_CACHE_FILE)
+        fp = _key_fingerprint(cache, api_key)
+        now = time.time()
+        entries = {k: v for k, v in cache.get("providers", {}).items()
+                   if now - v.get("time", 0) <= DETECT_CACHE_TTL}
+        entries[fp] = {"provider": {k: provider.get(k) for k in _CACHED_PROVIDER_FIELDS},
+                       "time": now}
+        cache["providers"] = entries
+        _save_json_cache(DETECT_CACHE_FILE, cache)
+
+
+def invalidate_cached_provider(api_key):
+    """删除密钥的识别缓存 (缓存的服务商返回 401 时调用)"""
+    with _cache_lock:
+        cache = _load_json_cache(DETECT_CACHE_FILE)
+        if not cache.get("salt"):
+            return
+        if cache.get("providers", {}).pop(_key_fingerprint(cache, api_key), None):
+            _save_json_cache(DETECT_CACHE_FILE, cache)
+
+
+# 服务商能力缓存：按 base_url 记录探测结果 (如哪个余额端点可用)，与密钥无关
+CAPABILITY_CACHE_FILE = os.path.join(CACHE_DIR, "capability_cache.json")
+CAPABILITY_CACHE_TTL = 7 * 24 * 3600
+
+
+def load_capability(base_url, name):
+    """读取 base_url 已探测到的能力，返回 (是否命中, 值)；值为 None 表示已确认不支持"""
+    with _cache_lock:
+        cache = _load_json_cache(CAPABILITY_CACHE_FILE)
+    entry = (cache.get(base_url.rstrip("/")) or {}).get(name)
+    if not entry or time.time() - entry.get("time", 0) > CAPABILITY_CACHE_TTL:
+        return False, None
+    return True, entry.get("value")
+
+
+def save_capability(base_url, name, value):
+    """记录 base_url 的某项能力探测结果"""
+    with _cache_lock:
+        cache = _load_json_cache(CAPABILITY_CACHE_FILE)
+        cache.setdefault(base_url.rstrip("/"), {})[name] = {"value": value, "time": time.time()}
+        _save_json_cache(CAPABILITY_CACHE_FILE, cache)
+
+
+def auto_detect_provider(api_key, custom_url=None, use_cache=True):
     """全自动识别 API 服务商。
     1. 若用户指定了自定义 URL → 直接使用
     2. 按密钥前缀匹配 → 直接识别
-    3. 通用 sk- 前缀 → 逐一探测
+    3. 本地识别缓存命中 → 直接使用 (use_cache=False 时跳过)
+    4. 通用 sk- 前缀 → 并行探测，结果写入缓存
     """
     # 用户手动指定 URL
     if custom_url:
@@ -249,29 +497,44 @@ def auto_detect_provider(api_key, custom_url=None):
         print_detected_provider(provider)
         return provider
 
-    # 2. 探测
+    # 2. 识别缓存
+    if use_cache:
+        provider = load_cached_provider(api_key)
+        if provider:
+            print(c("  ⚡ 命中本地识别缓存，跳过探测 (--no-cache 可强制重新探测)", C.GRAY))
+            print()
+            print_detected_provider(provider)
+            return provider
+
+    # 3. 探测
     if api_key.startswith("sk-"):
-        print(c("  密钥格式: sk-*** (通用格式，正在逐一探测服务商...)", C.GRAY))
+        print(c("  密钥格式: sk-*** (通用格式，正在并行探测服务商...)", C.GRAY))
         print()
         provider = probe_openai_providers(api_key)
         if provider:
+            save_cached_provider(api_key, provider)
             print()
             print_detected_provider(provider)
             return provider
 
-    # 3. 未知格式也尝试探测
+    # 4. 未知格式也尝试探测
     if not api_key.startswith("sk-"):
         print(c(f"  密钥格式: {api_key[:6]}*** (非标准格式，尝试探测...)", C.YELLOW))
         print()
         provider = probe_openai_providers(api_key)
         if provider:
+            save_cached_provider(api_key, provider)
             print()
             print_detected_provider(provider)
             return provider
 
-    # 4. 自动探测失败 → 提供手动选择
+    # 5. 自动探测失败 → 提供手动选择
     print()
     print(c("  ⚠️  自动探测未能匹配到服务商", C.YELLOW))
+    if HEADLESS:
+        print(c("     无头模式无法手动选择，请在第二个参数中指定 API 地址", C.GRAY))
+        emit_event("error", stage="detect", message="自动探测未能匹配到服务商")
+        safe_exit(1)
     print(c("     你可以手动选择，或输入自定义地址:", C.GRAY))
     print()
 
@@ -295,7 +558,7 @@ def auto_detect_provider(api_key, custom_url=None):
     print()
 
     try:
-        choice = input(c("  请选择 (输入编号，直接回车退出): ", C.BOLD)).strip()
+        choice = ask(c("  请选择 (输入编号，直接回车退出): ", C.BOLD)).strip()
     except (EOFError, KeyboardInterrupt):
         print()
         safe_exit(0)
@@ -317,7 +580,7 @@ def auto_detect_provider(api_key, custom_url=None):
         safe_exit(1)
 
     if idx == 0:
-        custom = input(c("  请输入 API 地址 (如 https://api.xxx.com/v1): ", C.BOLD)).strip()
+        custom = ask(c("  请输入 API 地址 (如 https://api.xxx.com/v1): ", C.BOLD)).strip()
         if not custom:
             safe_exit(0)
         provider = {"name": "自定义", "icon": "🔧", "base_url": custom.rstrip("/"),
@@ -335,6 +598,30 @@ def auto_detect_provider(api_key, custom_url=None):
         safe_exit(1)
 
 
+def detect_provider_quiet(api_key, custom_url=None, use_cache=True):
+    """不打印、不交互的服务商识别 (批量模式使用)，无法识别或不支持时返回 None"""
+    if custom_url:
+        fmt = FORMAT_GEMINI if api_key.startswith("AIza") else FORMAT_OPENAI
+        return {"name": "自定义", "icon": "🔧", "base_url": custom_url,
+                "format": fmt, "needs_proxy_cn": False}
+
+    provider = detect_provider_by_prefix(api_key)
+    if provider:
+        return provider if provider["format"] in (FORMAT_GEMINI, FORMAT_OPENAI) else None
+
+    if use_cache:
+        provider = load_cached_provider(api_key)
+        if provider:
+            return provider
+
+    matched, _ = race_probe_providers(api_key)
+    if matched is None:
+        return None
+    provider = dict(PROBE_PROVIDERS[matched])
+    save_cached_provider(api_key, provider)
+    return provider
+
+
 def print_detected_provider(provider):
     """打印已识别的服务商信息"""
     name = provider["name"]
@@ -372,22 +659,24 @@ def run_openai_diagnostic(provider, proxy_port=None, proxy_name=None):
     # 连通性
     base_url = provider["base_url"]
     try:
-        t0 = time.time()
-        resp = _session.get(f"{base_url}/models",
-                            headers={"Authorization": "Bearer __test__"},
-                            timeout=10)
-        latency = int((time.time() - t0) * 1000)
+        with measure_latency() as recorder:
+            resp = _session.get(f"{base_url}/models",
+                                headers={"Authorization": "Bearer __test__"},
+                                timeout=10)
+        latency = fmt_latency(recorder.as_dict())
         if resp.status_code in (200, 401, 403):
             check_item(f"{provider['name']} 连通性", "ok",
-                       f"HTTP {resp.status_code}, 延迟 {latency}ms")
+                       f"HTTP {resp.status_code}, 延迟 {latency}")
         else:
             check_item(f"{provider['name']} 连通性", "warn",
-                       f"HTTP {resp.status_code}, 延迟 {latency}ms")
+                       f"HTTP {resp.status_code}, 延迟 {latency}")
     except Exception as e:
         check_item(f"{provider['name']} 连通性", "fail", str(e)[:60],
                    "无法连接到服务商，请检查网络或代理配置")
         all_ok = False
 
+    emit_event("diagnostic", ok=all_ok,
+               proxy=f"http://127.0.0.1:{proxy_port}" if proxy_port else None)
     print()
     if all_ok:
         print(c("  ╔═══════════════════════════════════════════════════════════════╗", C.GREEN))
@@ -398,7 +687,7 @@ def run_openai_diagnostic(provider, proxy_port=None, proxy_name=None):
         print(c("  ║  ⚠️  网络可能存在问题                                         ║", C.YELLOW))
         print(c("  ╚═══════════════════════════════════════════════════════════════╝", C.YELLOW))
         print()
-        choice = input(c("  是否仍要继续测试? (Y/n): ", C.BOLD)).strip().lower()
+        choice = ask(c("  是否仍要继续测试? (Y/n): ", C.BOLD), "y").strip().lower()
         if choice == "n":
             safe_exit(0)
     print()
@@ -408,8 +697,362 @@ def run_openai_diagnostic(provider, proxy_port=None, proxy_name=None):
 
 OFFICIAL_URL = "https://generativelanguage.googleapis.com/v1beta"
 
-_session = requests.Session()
-_session.verify = False
+DEFAULT_POOL_SIZE = 32   # 每个主机保持的最大连接数
+
+
+class ConnectionStats:
+    """按主机统计请求数、新建连接数与 TLS 握手次数 (线程安全)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _entry(self, host):
+        return self._hosts.setdefault(
+            host, {"requests": 0, "new_connections": 0, "tls_handshakes": 0})
+
+    def record_request(self, host):
+        with self._lock:
+            self._entry(host)["requests"] += 1
+
+    def record_connection(self, host):
+        with self._lock:
+            self._entry(host)["new_connections"] += 1
+
+    def record_tls_handshake(self, host):
+        with self._lock:
+            self._entry(host)["tls_handshakes"] += 1
+
+    def snapshot(self):
+        """返回 {host: {requests, new_connections, reused_connections, tls_handshakes}}"""
+        with self._lock:
+            result = {}
+            for host, e in self._hosts.items():
+                result[host] = dict(e)
+                result[host]["reused_connections"] = max(0, e["requests"] - e["new_connections"])
+            return result
+
+
+# ─── 请求延迟分解 ──
+
+_timing_local = threading.local()
+
+
+class LatencyRecorder:
+    """记录当前线程一次调用的延迟分解 (毫秒)：DNS、TCP 连接、TLS 握手、首字节、总耗时。
+    复用已有连接时 DNS/连接/TLS 均为 0。"""
+
+    PHASES = ("dns", "connect", "tls", "ttfb", "total")
+
+    def __init__(self):
+        self.phases = dict.fromkeys(self.PHASES, 0.0)
+        self.reused = True
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds * 1000
+
+    def as_dict(self):
+        result = {k: round(v, 1) for k, v in self.phases.items()}
+        result["reused"] = self.reused
+        return result
+
+
+@contextmanager
+def measure_latency():
+    """在 with 块内记录本线程发出的请求的延迟分解"""
+    recorder = LatencyRecorder()
+    previous = getattr(_timing_local, "recorder", None)
+    _timing_local.recorder = recorder
+    t0 = time.perf_counter()
+    try:
+        yield recorder
+    finally:
+        recorder.add("total", time.perf_counter() - t0)
+        _timing_local.recorder = previous
+
+
+def _record_phase(phase, seconds, new_connection=False):
+    recorder = getattr(_timing_local, "recorder", None)
+    if recorder is not None:
+        recorder.add(phase, seconds)
+        if new_connection:
+            recorder.reused = False
+
+
+def _counting_pool_classes(stats):
+    """生成带计时与连接统计的 urllib3 连接池类：
+    新建 socket 时单独计时 DNS 解析与 TCP 连接，HTTPS 另计 TLS 握手，
+    每次请求记录发出请求到收到响应头的等待时间 (TTFB)。"""
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    from urllib3.exceptions import ConnectTimeoutError
+
+    def timed_new_conn(conn, new_conn):
+        hostname = conn._dns_host
+        t0 = time.perf_counter()
+        try:
+            # 先行解析以单独计时 DNS；IPv4 优先，其余地址 (含 IPv6) 依次作为后备，
+            # 与 urllib3 自行解析时的逐个尝试行为一致
+            infos = socket.getaddrinfo(hostname, conn.port, 0, socket.SOCK_STREAM)
+            infos.sort(key=lambda i: i[0] != socket.AF_INET)
+            addresses = list(dict.fromkeys(i[4][0] for i in infos))
+        except OSError:
+            addresses = []  # 交给 urllib3 报告解析错误
+        t1 = time.perf_counter()
+        # 连接期间临时替换为 IP，之后恢复原主机名，Host 头与 SNI 不受影响
+        candidates = addresses or [hostname]
+        try:
+            for i, address in enumerate(candidates):
+                conn._dns_host = address
+                try:
+                    sock = new_conn()
+                    break
+                except ConnectTimeoutError:  # 含 NewConnectionError：换下一个地址
+                    if i == len(candidates) - 1:
+                        raise
+        finally:
+            conn._dns_host = hostname
+        t2 = time.perf_counter()
+        stats.record_connection(conn.host)
+        _record_phase("dns", t1 - t0, new_connection=True)
+        _record_phase("connect", t2 - t1)
+        conn._socket_seconds = t2 - t0
+        return sock
+
+    class TimedConnectionMixin:
+        def _new_conn(self):
+            return timed_new_conn(self, super()._new_conn)
+
+        def request(self, *args, **kwargs):
+            super().request(*args, **kwargs)
+            self._sent_at = time.perf_counter()
+
+        def getresponse(self, *args, **kwargs):
+            resp = super().getresponse(*args, **kwargs)
+            if getattr(self, "_sent_at", None):
+                _record_phase("ttfb", time.perf_counter() - self._sent_at)
+            return resp
+
+    class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+        pass
+
+    class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+        def connect(self):
+            self._socket_seconds = 0.0
+            t0 = time.perf_counter()
+            super().connect()
+            _record_phase("tls", max(0.0, time.perf_counter() - t0 - self._socket_seconds))
+            stats.record_tls_handshake(self.host)
+
+    class CountingHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+
+    class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+    return {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+
+
+class PooledHTTPAdapter(requests.adapters.HTTPAdapter):
+    """可配置连接池大小的 HTTPAdapter，并统计每个主机的连接复用情况"""
+
+    def __init__(self, stats, pool_size=DEFAULT_POOL_SIZE, pool_block=False):
+        self._stats = stats
+        self._pool_classes = _counting_pool_classes(stats)
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size,
+                         pool_block=pool_block)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        manager.pool_classes_by_scheme = self._pool_classes
+        return manager
+
+    def send(self, request, **kwargs):
+        from urllib.parse import urlparse
+        self._stats.record_request(urlparse(request.url).hostname or "")
+        return super().send(request, **kwargs)
+
+
+class _HTTPXRawStream:
+    """把 httpx 流式响应包装成 requests 可逐块读取的 raw 对象"""
+
+    def __init__(self, response):
+        self._response = response
+        self._chunks = response.iter_bytes()
+        self._buffer = b""
+
+    def read(self, amt=None, **kwargs):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return b""
+        if amt is None:
+            amt = len(self._buffer)
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        self._response.close()
+
+    def release_conn(self):
+        self._response.close()
+
+
+class HTTP2Adapter(requests.adapters.BaseAdapter):
+    """基于 httpx 的 HTTP/2 传输 (可选依赖: pip install "httpx[http2]")。
+    同一主机的请求在一条 HTTP/2 连接上多路复用。"""
+
+    def __init__(self, stats, pool_size=DEFAULT_POOL_SIZE):
+        import httpx  # 未安装时由调用方回退到 PooledHTTPAdapter
+        import h2  # noqa: F401  缺少 h2 时 httpx 要到首个请求才报错，这里提前触发回退
+        super().__init__()
+        self._httpx = httpx
+        self._stats = stats
+        self._limits = httpx.Limits(max_connections=pool_size,
+                                    max_keepalive_connections=pool_size)
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _client(self, proxy, verify):
+        key = (proxy, bool(verify))
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                kwargs = {"http2": True, "verify": verify, "limits": self._limits}
+                try:
+                    client = self._httpx.Client(proxy=proxy, **kwargs)
+                except TypeError:  # httpx < 0.26
+                    client = self._httpx.Client(proxies=proxy, **kwargs)
+                self._clients[key] = client
+            return client
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        from urllib.parse import urlparse
+        from requests.structures import CaseInsensitiveDict
+        httpx = self._httpx
+        host = urlparse(request.url).hostname or ""
+        scheme = urlparse(request.url).scheme
+        proxy = (proxies or {}).get(scheme) or (proxies or {}).get("all")
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+
+        started = {}
+
+        def trace(event, info):
+            phase, _, stage = event.rpartition(".")
+            if stage == "started":
+                started[phase] = time.perf_counter()
+                return
+            if stage != "complete" or phase not in started:
+                return
+            elapsed = time.perf_counter() - started[phase]
+            if phase == "connection.connect_tcp":
+                self._stats.record_connection(host)
+                _record_phase("connect", elapsed, new_connection=True)  # httpcore 的 TCP 连接含 DNS
+            elif phase == "connection.start_tls":
+                self._stats.record_tls_handshake(host)
+                _record_phase("tls", elapsed)
+            elif phase.endswith("receive_response_headers"):
+                _record_phase("ttfb", elapsed)
+
+        self._stats.record_request(host)
+        t0 = time.perf_counter()
+        try:
+            client = self._client(proxy, verify)
+            req = client.build_request(
+                request.method, request.url, headers=dict(request.headers),
+                content=request.body, timeout=timeout, extensions={"trace": trace})
+            r = client.send(req, stream=stream)
+        except httpx.ProxyError as e:
+            raise requests.exceptions.ProxyError(e, request=request)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e, request=request)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+
+        resp = requests.Response()
+        resp.status_code = r.status_code
+        resp.headers = CaseInsensitiveDict(r.headers.items())
+        if stream:
+            # 流式读取：body 已由 httpx 解压，去掉编码头避免重复解码
+            resp.headers.pop("content-encoding", None)
+            resp.raw = _HTTPXRawStream(r)
+        else:
+            resp._content = r.content
+        resp.encoding = r.encoding
+        resp.reason = r.reason_phrase
+        resp.url = request.url
+        resp.request = request
+        resp.connection = self
+        resp.elapsed = datetime.timedelta(seconds=time.perf_counter() - t0)
+        return resp
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+
+_connection_stats = ConnectionStats()
+
+
+def configure_session(session, pool_size=DEFAULT_POOL_SIZE, pool_block=False, http2=False,
+                      stats=None):
+    """为会话挂载连接池适配器：pool_size 控制每个主机的最大连接数，
+    pool_block=True 时连接池用尽后等待而不是新建临时连接；
+    http2=True 时改用 HTTP/2 传输 (需要 httpx[http2]，缺失时回退 HTTP/1.1)。"""
+    stats = stats or _connection_stats
+    adapter = None
+    if http2:
+        try:
+            adapter = HTTP2Adapter(stats, pool_size)
+        except ImportError:
+            print(c('  ⚠️  未安装 httpx[http2]，回退到 HTTP/1.1 (pip install "httpx[http2]")', C.YELLOW))
+    if adapter is None:
+        adapter = PooledHTTPAdapter(stats, pool_size, pool_block)
+    # 重新配置时关闭原有适配器，释放其连接池
+    previous = {id(a): a for a in (session.adapters.get("https://"),
+                                   session.adapters.get("http://")) if a is not None}
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    for old in previous.values():
+        old.close()
+    return session
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, pool_block=False, http2=False, stats=None):
+    """创建带可配置连接池的 requests 会话 (不校验证书，与原有行为一致)"""
+    session = requests.Session()
+    session.verify = False
+    return configure_session(session, pool_size, pool_block, http2, stats)
+
+
+_session = create_session()
+
+
+def print_connection_stats(stats=None):
+    """打印每个主机的连接复用统计"""
+    snapshot = (stats or _connection_stats).snapshot()
+    emit_event("connection_stats", hosts=snapshot)
+    if not snapshot:
+        return
+    print()
+    print(c("  🔌 连接复用统计", C.BOLD))
+    divider("─", 72)
+    print(c(f"  {'主机':<36s}  {'请求':>6s}  {'新建':>6s}  {'复用':>6s}  {'TLS 握手':>8s}", C.GRAY))
+    for host, e in sorted(snapshot.items(), key=lambda x: -x[1]["requests"]):
+        reused = e["reused_connections"]
+        print(f"  {c(f'{host[:36]:<36s}', C.WHITE)}  {e['requests']:>6d}  "
+              f"{e['new_connections']:>6d}  {c(f'{reused:>6d}', C.GREEN)}  "
+              f"{e['tls_handshakes']:>8d}")
+    print()
 
 def detect_proxy():
     """自动检测本地代理端口"""
@@ -426,6 +1069,17 @@ def detect_proxy():
             pass
     return None, None
 
+def configure_session_proxy():
+    """检测本地代理并配置到共享会话，返回 (端口, 代理名称)"""
+    port, name = detect_proxy()
+    if port:
+        px = f"http://127.0.0.1:{port}"
+        _session.proxies = {"http": px, "https": px}
+        _session.trust_env = False
+    elif urllib.request.getproxies():
+        _session.trust_env = True
+    return port, name
+
 def check_item(label, status, detail="", hint=""):
     """打印一项诊断结果"""
     if status == "ok":
@@ -576,6 +1230,7 @@ def run_network_diagnostic(base_url=None):
         all_ok = False
 
     # ── 诊断总结 ──
+    emit_event("diagnostic", ok=all_ok, proxy=proxy_url, exit_ip=exit_ip, region=ip_region)
     print()
     if all_ok:
         print(c("  ╔═══════════════════════════════════════════════════════════════╗", C.GREEN))
@@ -593,7 +1248,7 @@ def run_network_diagnostic(base_url=None):
             print(c("  ║    或使用反向代理地址 (运行时传入第二个参数)                 ║", C.YELLOW))
         print(c("  ╚═══════════════════════════════════════════════════════════════╝", C.YELLOW))
         print()
-        choice = input(c("  是否仍要继续测试? (Y/n): ", C.BOLD)).strip().lower()
+        choice = ask(c("  是否仍要继续测试? (Y/n): ", C.BOLD), "y").strip().lower()
         if choice == "n":
             print()
             safe_exit(0)
@@ -849,76 +1504,113 @@ def translate_error(status_code, error_msg):
     return status_hint
 
 
-def query_openai_balance(base_url, api_key, provider_name):
-    """尝试查询 OpenAI 兼容服务商的账户余额/使用量信息"""
-    balance_info = {}
+# 不同服务商有不同的余额查询端点
+BALANCE_ENDPOINTS = [
+    # SiliconFlow
+    {"path": "/user/info",       "type": "siliconflow"},
+    # DeepSeek
+    {"path": "/user/balance",    "type": "deepseek"},
+    # 通用 OpenAI dashboard
+    {"path": "/dashboard/billing/credit_grants", "type": "openai_credit"},
+    {"path": "/dashboard/billing/usage",         "type": "openai_usage"},
+]
+BALANCE_TIMEOUT = 8
 
-    # 不同服务商有不同的余额查询端点
-    balance_endpoints = [
-        # SiliconFlow
-        {"path": "/user/info",       "type": "siliconflow"},
-        # DeepSeek
-        {"path": "/user/balance",    "type": "deepseek"},
-        # 通用 OpenAI dashboard
-        {"path": "/dashboard/billing/credit_grants", "type": "openai_credit"},
-        {"path": "/dashboard/billing/usage",         "type": "openai_usage"},
-    ]
 
-    headers = {"Authorization": f"Bearer {api_key}"}
+def _parse_balance(ep_type, data):
+    """按端点类型解析余额响应，无法识别时返回空字典"""
+    if ep_type == "siliconflow":
+        # SiliconFlow: {"data": {"balance": "1.23", ...}}
+        bal = (data.get("data") or {}).get("balance")
+        if bal is not None:
+            return {"balance": float(bal), "currency": "CNY", "source": "SiliconFlow"}
+
+    elif ep_type == "deepseek":
+        # DeepSeek: {"balance_infos": [{"currency":"CNY","total_balance":"5.00",...}]}
+        infos = data.get("balance_infos", [])
+        if infos:
+            bi = infos[0]
+            return {"balance": float(bi.get("total_balance", 0)),
+                    "currency": bi.get("currency", "CNY"), "source": "DeepSeek"}
+        if data.get("is_available") is not None:
+            return {"available": data.get("is_available", False), "source": "DeepSeek"}
+
+    elif ep_type == "openai_credit" and "total_granted" in data:
+        # OpenAI: {"total_granted": 18.0, "total_used": 1.2, ...}
+        total = data.get("total_granted", 0)
+        used = data.get("total_used", 0)
+        return {"balance": total - used, "total_granted": total, "total_used": used,
+                "currency": "USD", "source": "OpenAI"}
+
+    return {}
+
+
+def _probe_balance_endpoint(url_base, ep, headers):
+    """请求单个余额端点，返回 (解析结果, 是否为确定性失败)。
+    确定性失败指端点明确不存在 (如 404)，而非认证、限流或网络问题；
+    返回 200 但内容无法识别 (网关兜底页等) 时同样不算确定性失败。"""
+    try:
+        resp = _session.get(f"{url_base}{ep['path']}", headers=headers, timeout=BALANCE_TIMEOUT)
+    except Exception:
+        return {}, False
+    if resp.status_code != 200:
+        return {}, resp.status_code not in (401, 403, 429) and resp.status_code < 500
+    try:
+        return _parse_balance(ep["type"], resp.json()), False
+    except (ValueError, TypeError, AttributeError):
+        return {}, False
+
+
+def query_openai_balance(base_url, api_key, provider_name, use_cache=True):
+    """尝试查询 OpenAI 兼容服务商的账户余额/使用量信息
+    所有候选端点并发探测，按 BALANCE_ENDPOINTS 的顺序采用第一个解析成功的结果；
+    可用端点按 base_url 记入能力缓存，之后同一服务商只需请求一次。
+    所有端点都明确不支持 (如 404) 时同样缓存，下次直接跳过。"""
+    # 构建 URL: 移除 /v1 后缀再拼接
+    url_base = base_url.rstrip("/")
+    if url_base.endswith("/v1"):
+        url_base = url_base[:-3]
+    elif url_base.endswith("/v4"):
+        url_base = url_base[:-3]
 
-    for ep in balance_endpoints:
-        # 构建 URL: 移除 /v1 后缀再拼接
-        url_base = base_url.rstrip("/")
-        if url_base.endswith("/v1"):
-            url_base = url_base[:-3]
-        elif url_base.endswith("/v4"):
-            url_base = url_base[:-3]
+    headers = {"Authorization": f"Bearer {api_key}"}
 
-        url = f"{url_base}{ep['path']}"
-        try:
-            resp = _session.get(url, headers=headers, timeout=8)
-            if resp.status_code == 200:
-                data = resp.json()
-                ep_type = ep["type"]
-
-                if ep_type == "siliconflow":
-                    # SiliconFlow: {"data": {"balance": "1.23", ...}}
-                    bal = data.get("data", {}).get("balance")
-                    if bal is not None:
-                        balance_info["balance"] = float(bal)
-                        balance_info["currency"] = "CNY"
-                        balance_info["source"] = "SiliconFlow"
-                        break
-
-                elif ep_type == "deepseek":
-                    # DeepSeek: {"balance_infos": [{"currency":"CNY","total_balance":"5.00",...}]}
-                    infos = data.get("balance_infos", [])
-                    if not infos and data.get("is_available") is not None:
-                        balance_info["available"] = data.get("is_available", False)
-                        balance_info["source"] = "DeepSeek"
-                        break
-                    for bi in infos:
-                        balance_info["balance"] = float(bi.get("total_balance", 0))
-                        balance_info["currency"] = bi.get("currency", "CNY")
-                        balance_info["source"] = "DeepSeek"
-                        break
-                    if balance_info:
-                        break
-
-                elif ep_type == "openai_credit":
-                    total = data.get("total_granted", 0)
-                    used = data.get("total_used", 0)
-                    balance_info["balance"] = total - used
-                    balance_info["total_granted"] = total
-                    balance_info["total_used"] = used
-                    balance_info["currency"] = "USD"
-                    balance_info["source"] = "OpenAI"
+    if use_cache:
+        hit, cached_path = load_capability(url_base, "balance_endpoint")
+        if hit and cached_path is None:
+            return {}
+        ep = next((e for e in BALANCE_ENDPOINTS if e["path"] == cached_path), None)
+        if ep is not None:
+            balance_info, _ = _probe_balance_endpoint(url_base, ep, headers)
+            if balance_info:
+                return balance_info
+            # 缓存的端点失效 (服务商变更)，回退到完整探测
+
+    done, found = {}, None
+    pool = ThreadPoolExecutor(max_workers=len(BALANCE_ENDPOINTS))
+    futures = {pool.submit(_probe_balance_endpoint, url_base, ep, headers): i
+               for i, ep in enumerate(BALANCE_ENDPOINTS)}
+    try:
+        for fut in as_completed(futures):
+            done[futures[fut]] = fut.result()
+            # 排在前面的端点都已失败时，才能采用这个结果
+            for i in range(len(BALANCE_ENDPOINTS)):
+                if i not in done:
                     break
+                if done[i][0]:
+                    found = i
+                    break
+            if found is not None:
+                break
+    finally:
+        pool.shutdown(wait=False)  # 其余探测在后台自然结束，不再等待
 
-        except Exception:
-            continue
-
-    return balance_info
+    if found is not None:
+        save_capability(url_base, "balance_endpoint", BALANCE_ENDPOINTS[found]["path"])
+        return done[found][0]
+    if all(definitive for _, definitive in done.values()):
+        save_capability(url_base, "balance_endpoint", None)
+    return {}
 
 
 def print_account_diagnosis(provider, api_key, base_url, balance_info, models, test_results):
@@ -1112,6 +1804,330 @@ def openai_test_model(base_url, api_key, model):
         return False, f"未知错误: {str(e)[:40]}"
 
 
+# ─── 并发测试引擎 ────────────────────────────────────────────
+
+DEFAULT_TEST_WORKERS = 8     # 默认并发线程数
+DEFAULT_RATE_BUDGET = 10.0   # 默认每个服务商每秒最多发出的请求数
+
+# 各服务商的速率预算 (请求/秒)，未列出的使用 DEFAULT_RATE_BUDGET
+PROVIDER_RATE_BUDGETS = {
+    "Google Gemini": 5.0,
+    "Groq":          20.0,
+    "OpenAI":        10.0,
+    "硅基流动":       15.0,
+    "DeepSeek":      10.0,
+    "Mistral":       4.0,
+}
+
+
+class RateBudget:
+    """令牌桶限速器：限制单个服务商每秒发出的请求数 (线程安全)"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = max(float(rate), 0.1)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取得一个令牌，令牌不足时阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def retune(self, rate, burst=None):
+        """按服务端公布的限额调整速率与桶容量，已积累的令牌不超过新容量"""
+        with self._lock:
+            self.rate = max(float(rate), 0.1)
+            self.capacity = float(burst or max(1.0, self.rate))
+            self._tokens = min(self._tokens, self.capacity)
+
+    def cap(self, remaining):
+        """服务端报告的剩余请求数少于桶内令牌时，以服务端为准"""
+        with self._lock:
+            self._tokens = min(self._tokens, max(float(remaining), 0.0))
+
+
+_rate_budgets = {}
+_rate_budgets_lock = threading.Lock()
+
+
+def get_rate_budget(provider_name, rate=None):
+    """获取 (或创建) 服务商共享的速率预算，同一服务商的所有线程共用一个令牌桶"""
+    with _rate_budgets_lock:
+        budget = _rate_budgets.get(provider_name)
+        if budget is None or (rate is not None and budget.rate != float(rate)):
+            if rate is None:
+                rate = PROVIDER_RATE_BUDGETS.get(provider_name, DEFAULT_RATE_BUDGET)
+            budget = RateBudget(rate)
+            _rate_budgets[provider_name] = budget
+        return budget
+
+
+RATE_BACKOFF_BASE = 1.0      # 429 且没有 Retry-After 时的首次退避秒数
+RATE_BACKOFF_MAX = 60.0      # 指数退避上限
+RATE_LIMIT_RETRIES = 1       # 测试请求遇到 429 后等待限流解除再重试的次数
+
+
+def parse_duration(value):
+    """解析限流头中的时长："6m0s"、"1.5s"、"20ms"、纯数字秒数或 HTTP 日期，返回秒数"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().lower()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    total, number, matched = 0.0, "", False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if ch.isdigit() or ch == ".":
+            number += ch
+            i += 1
+            continue
+        unit = "ms" if text.startswith("ms", i) else ch
+        scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}.get(unit)
+        if scale is None or not number:
+            break
+        total += float(number) * scale
+        number, matched = "", True
+        i += len(unit)
+    else:
+        if matched and not number:
+            return total
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(str(value)).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """按 (服务商, 模型, 密钥指纹) 维护令牌桶的自适应限速器 (线程安全)
+    初始速率取自 KNOWN_FREE_LIMITS，之后根据每个响应的 x-ratelimit-* 头实时调整；
+    收到 429 或剩余额度为 0 时按 Retry-After / reset 头暂停该模型，
+    没有这些头时按指数退避。上游限额按密钥 (项目) 计算，因此批量模式下
+    一个密钥被限流不会拖慢其他密钥。服务商级别的总速率仍由 get_rate_budget 控制。"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._blocked_until = {}
+        self._backoff = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key):
+        with self._lock:
+            if key not in self._buckets:
+                known, _ = lookup_known_limits(key[1])
+                rpm = (known or {}).get("rpm")
+                self._buckets[key] = RateBudget(rpm / 60, burst=rpm) if rpm else None
+            return self._buckets[key]
+
+    @staticmethod
+    def make_key(provider_name, model_name, api_key=""):
+        """限速状态的键: (服务商, 模型, 密钥 SHA-256 前 12 位)"""
+        return (provider_name, model_name,
+                hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12])
+
+    def acquire(self, key, rate=None):
+        """等待服务商预算、模型令牌桶以及 429 暂停期全部放行"""
+        get_rate_budget(key[0], rate).acquire()
+        bucket = self._bucket(key)
+        if bucket is not None:
+            bucket.acquire()
+        while True:
+            with self._lock:
+                wait = self._blocked_until.get(key, 0) - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def block(self, key, seconds):
+        """在 seconds 秒内暂停该密钥对该模型的所有请求"""
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._blocked_until[key] = max(self._blocked_until.get(key, 0), until)
+
+    def observe(self, key, status, headers):
+        """根据响应状态码与限流头更新令牌桶"""
+        info = parse_rate_limit_headers(headers)
+        rpm = info.get("rpm") if isinstance(info.get("rpm"), int) else info.get("limit")
+        remaining = info.get("rpm_remaining", info.get("remaining"))
+
+        if isinstance(rpm, int) and rpm > 0:
+            bucket = self._bucket(key)
+            with self._lock:
+                if bucket is None:
+                    bucket = self._buckets[key] = RateBudget(rpm / 60, burst=rpm)
+            if bucket.capacity != rpm:
+                bucket.retune(rpm / 60, burst=rpm)
+        if isinstance(remaining, int):
+            bucket = self._bucket(key)
+            if bucket is not None:
+                bucket.cap(remaining)
+
+        retry_after = parse_duration(info.get("retry_after"))
+        if status == 429:
+            with self._lock:
+                backoff = self._backoff.get(key, RATE_BACKOFF_BASE / 2) * 2
+                self._backoff[key] = min(backoff, RATE_BACKOFF_MAX)
+            self.block(key, retry_after if retry_after is not None else self._backoff[key])
+            return
+        with self._lock:
+            self._backoff.pop(key, None)
+        if remaining == 0:
+            reset = parse_duration(info.get("rpm_reset"))
+            self.block(key, retry_after or reset or RATE_BACKOFF_BASE)
+
+
+_rate_limiter = AdaptiveRateLimiter()
+_rate_local = threading.local()
+
+
+@contextmanager
+def rate_limited(provider_name, model_name, rate=None, api_key=""):
+    """在限速器放行后执行请求，块内经 _session 发出的响应会回馈给限速器。
+    产出的 slot["status"] / slot["headers"] 记录最后一个响应的状态码与响应头，
+    便于调用方在 429 时重试，或复用响应头中的限流信息。"""
+    key = AdaptiveRateLimiter.make_key(provider_name, model_name, api_key)
+    _rate_limiter.acquire(key, rate)
+    slot = {"key": key, "status": None, "headers": None}
+    previous = getattr(_rate_local, "slot", None)
+    _rate_local.slot = slot
+    try:
+        yield slot
+    finally:
+        _rate_local.slot = previous
+
+
+def _observe_rate_limits(response, *args, **kwargs):
+    """requests 响应钩子：把当前线程 rate_limited 块内的响应头交给限速器"""
+    slot = getattr(_rate_local, "slot", None)
+    if slot is not None:
+        slot["status"] = response.status_code
+        slot["headers"] = response.headers
+        _rate_limiter.observe(slot["key"], response.status_code, response.headers)
+    return response
+
+
+_session.hooks["response"].append(_observe_rate_limits)
+
+
+# 说明整个密钥已失效 (而非单个模型不可用) 的状态码与 translate_error 译文
+KEY_FATAL_STATUSES = (401, 402)
+KEY_FATAL_ERRORS = {ERROR_TRANSLATIONS[s] for s in KEY_FATAL_STATUSES} | {
+    translate_error(0, kw) for kw in ("invalid api key", "authentication", "unauthorized",
+                                      "insufficient balance", "payment required",
+                                      "deactivated", "expired")}
+KEY_FATAL_THRESHOLD = 2      # 累计多少个模型出现密钥级错误后停止测试其余模型
+
+
+def is_key_level_error(status_code, message):
+    """判断一次失败是否说明整个密钥不可用 (认证失败 / 余额不足 / 账户停用)"""
+    return (status_code in KEY_FATAL_STATUSES or message in KEY_FATAL_ERRORS
+            or translate_error(status_code, message) in KEY_FATAL_ERRORS)
+
+
+class CancelToken:
+    """协作式取消令牌 (线程安全)
+    cancel() 之后尚未发出的请求直接跳过，已在途的请求照常完成；
+    reason 记录第一次取消的原因。"""
+
+    def __init__(self):
+        self.reason = ""
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self, reason="已取消"):
+        with self._lock:
+            if not self._event.is_set():
+                self.reason = reason
+                self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+def run_model_tests(base_url, api_key, models, api_format, provider_name="",
+                    workers=DEFAULT_TEST_WORKERS, rate=None, on_result=None,
+                    semaphore=None, latencies=None, cancel=None, rate_headers=None,
+                    statuses=None):
+    """并发测试所有模型，返回与 models 顺序一致的 {name: (True/False/None, message)}。
+    每完成一个模型即回调 on_result(done, total, model, result, latency)，用于刷新进度条。
+    semaphore 用于在多个密钥之间共享全局并发上限 (批量模式)；
+    传入 latencies 字典时同时填入每个模型测试请求的延迟分解 {name: {...}}；
+    传入 rate_headers 字典时填入测试响应的限流信息 {name: parse_rate_limit_headers(...)}，
+    供 fetch_all_quotas 复用，无需再为配额单独发请求；
+    传入 statuses 字典时填入测试响应的 HTTP 状态码 {name: status} (网络错误为 None)。
+    cancel 为 CancelToken：被取消 (或累计 KEY_FATAL_THRESHOLD 个密钥级错误) 后，
+    其余模型不再发出请求，结果记为 (None, "已跳过: 原因")。"""
+    test_fn = test_model if api_format == FORMAT_GEMINI else openai_test_model
+    cancel = cancel or CancelToken()
+    total = len(models)
+    results = {}
+    key_failures = []
+
+    def skipped():
+        return (None, f"已跳过: {cancel.reason}"), None
+
+    def task(model):
+        for _ in range(RATE_LIMIT_RETRIES + 1):
+            if cancel.cancelled:
+                return skipped()
+            # 先取得全局并发名额再开始计时，延迟中不含在信号量上排队的时间
+            with rate_limited(provider_name, model.get("name", ""), rate, api_key) as slot, \
+                    (semaphore or nullcontext()), measure_latency() as recorder:
+                if cancel.cancelled:  # 在限速器中排队期间被取消
+                    return skipped()
+                result = test_fn(base_url, api_key, model)
+            if slot["status"] != 429:
+                break
+        if rate_headers is not None and slot["headers"] is not None:
+            rate_headers[model.get("name", "")] = parse_rate_limit_headers(slot["headers"])
+        if statuses is not None:
+            statuses[model.get("name", "")] = slot["status"]
+        if result[0] is False and is_key_level_error(slot["status"], result[1]):
+            key_failures.append(model.get("name", ""))
+            if len(key_failures) >= KEY_FATAL_THRESHOLD:
+                cancel.cancel(f"密钥不可用 ({result[1]})")
+        return result, recorder.as_dict()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(task, m): m for m in models}
+        try:
+            for done, fut in enumerate(as_completed(futures), 1):
+                model = futures[fut]
+                try:
+                    result, latency = fut.result()
+                except Exception as e:
+                    result, latency = (False, str(e)[:50]), None
+                results[model.get("name", "")] = result
+                if latencies is not None and latency:
+                    latencies[model.get("name", "")] = latency
+                if on_result:
+                    on_result(done, total, model, result, latency)
+        except BaseException:
+            # Ctrl+C 或回调出错 (如 /api/run 的浏览器已断开)：让排队中的任务立即跳过，
+            # 否则线程池退出时仍会等它们把请求全部发完
+            cancel.cancel("已中止")
+            raise
+
+    return {m.get("name", ""): results[m.get("name", "")] for m in models}
+
+
 # ─── 模型分类与分组 ──────────────────────────────────────────
 
 def classify_model(model):
@@ -1286,6 +2302,9 @@ def parse_rate_limit_headers(headers):
         ("x-ratelimit-remaining-requests-per-day", "rpd_remaining"),
         ("x-ratelimit-limit", "limit"),
         ("x-ratelimit-remaining", "remaining"),
+        ("x-ratelimit-reset-requests", "rpm_reset"),
+        ("x-ratelimit-reset-tokens", "tpm_reset"),
+        ("x-ratelimit-reset", "reset"),
         ("retry-after", "retry_after"),
     ]
     for key_pattern, field in header_map:
@@ -1301,10 +2320,78 @@ def parse_rate_limit_headers(headers):
     return info
 
 
-def fetch_all_quotas(base_url, api_key, models, test_results, api_format=FORMAT_GEMINI):
+def lookup_known_limits(name):
+    """按模型名查找免费层参考限额 (先精确匹配，再前缀匹配)，返回 (限额, 来源) 或 (None, None)"""
+    if not name:
+        return None, None
+    if name in KNOWN_FREE_LIMITS:
+        return KNOWN_FREE_LIMITS[name], "参考值 (Google 官方)"
+    for known_name, known_limits in KNOWN_FREE_LIMITS.items():
+        if name.startswith(known_name) or known_name.startswith(name):
+            return known_limits, "参考值 (近似匹配)"
+    return None, None
+
+
+def compute_daily_max_output(entry):
+    """每日最大输出吞吐量 = min(RPD × 单次最大输出, TPM × 1440 分钟)"""
+    output_limit = entry.get("outputTokenLimit") or 0
+    rpd = entry.get("rpd") or 0
+    tpm = entry.get("tpm") or 0
+
+    daily_by_rpd = rpd * output_limit if rpd else None
+    daily_by_tpm = tpm * 1440 if tpm else None  # 1440 分钟/天
+
+    if daily_by_rpd and daily_by_tpm:
+        return min(daily_by_rpd, daily_by_tpm)
+    return daily_by_rpd or daily_by_tpm or None
+
+
+def build_quota_entry(model, header_info=None):
+    """由响应头解析结果 (parse_rate_limit_headers) 构建模型的配额条目，
+    响应头未给出 RPM 时回退至已知的免费层参考值"""
+    name = model["name"]
+    header_info = header_info or {}
+    entry = {
+        "displayName": model.get("displayName", name.replace("models/", "")),
+        "name": name,
+        "inputTokenLimit": model.get("inputTokenLimit"),
+        "outputTokenLimit": model.get("outputTokenLimit"),
+        "rpm": None,
+        "tpm": None,
+        "rpd": None,
+        "source": "未知",
+        "headers_raw": header_info.get("_raw", {}),
+    }
+
+    # 第 1 步: 采用响应头中的限额
+    if isinstance(header_info.get("rpm"), int):
+        entry["rpm"] = header_info["rpm"]
+        entry["source"] = "API 响应头"
+    if isinstance(header_info.get("tpm"), int):
+        entry["tpm"] = header_info["tpm"]
+    if isinstance(header_info.get("rpd"), int):
+        entry["rpd"] = header_info["rpd"]
+
+    # 第 2 步: 回退至已知参考限额
+    if entry["rpm"] is None:
+        known, source = lookup_known_limits(name)
+        if known:
+            entry["rpm"] = known.get("rpm")
+            entry["tpm"] = known.get("tpm")
+            entry["rpd"] = known.get("rpd")
+            entry["source"] = source
+
+    # 第 3 步: 计算每日最大输出吞吐量
+    entry["daily_max_output"] = compute_daily_max_output(entry)
+    return entry
+
+
+def fetch_all_quotas(base_url, api_key, models, test_results, api_format=FORMAT_GEMINI,
+                     provider_name="", cancel=None, rate_headers=None):
     """获取所有可用文本生成模型的配额信息
-    对每个可用模型发送一次轻量请求以捕获响应头中的速率限制信息，
-    无法获取时回退至已知的免费层参考值。"""
+    优先复用可用性测试时捕获的响应头 (rate_headers，见 run_model_tests)；
+    没有捕获到的模型才单独发送一次轻量请求，无法获取时回退至已知的免费层参考值。
+    cancel (CancelToken) 被取消后不再发出请求，只使用已捕获的响应头与参考值。"""
 
     # 只分析可用的文本生成模型
     gen_models = [m for m in models
@@ -1314,6 +2401,7 @@ def fetch_all_quotas(base_url, api_key, models, test_results, api_format=FORMAT_
     if not gen_models:
         return {}
 
+    rate_headers = rate_headers or {}
     print()
     print(c("  ⏳ 正在检测各模型配额限制...", C.CYAN))
     print()
@@ -1325,86 +2413,34 @@ def fetch_all_quotas(base_url, api_key, models, test_results, api_format=FORMAT_
         display = model.get("displayName", name.replace("models/", ""))
         progress_bar(i, len(gen_models), label=display)
 
-        entry = {
-            "displayName": display,
-            "name": name,
-            "inputTokenLimit": model.get("inputTokenLimit"),
-            "outputTokenLimit": model.get("outputTokenLimit"),
-            "rpm": None,
-            "tpm": None,
-            "rpd": None,
-            "source": "未知",
-            "headers_raw": {},
-        }
-
-        # 第 1 步: 发送轻量请求，捕获响应头
-        try:
-            if api_format == FORMAT_GEMINI:
-                url = f"{base_url}/{name}:generateContent?key={api_key}"
-                payload = {"contents": [{"parts": [{"text": "Hi"}]}],
-                           "generationConfig": {"maxOutputTokens": 1}}
-                resp = _session.post(url, json=payload, timeout=30)
-            else:
-                model_id = model.get("_model_id") or name.replace("models/", "")
-                payload = {"model": model_id,
-                           "messages": [{"role": "user", "content": "Hi"}],
-                           "max_tokens": 1}
-                resp = _session.post(f"{base_url}/chat/completions", json=payload,
-                                     headers={"Authorization": f"Bearer {api_key}",
-                                              "Content-Type": "application/json"},
-                                     timeout=30)
-            header_info = parse_rate_limit_headers(dict(resp.headers))
-            entry["headers_raw"] = header_info.get("_raw", {})
-
-            if "rpm" in header_info and isinstance(header_info["rpm"], int):
-                entry["rpm"] = header_info["rpm"]
-                entry["source"] = "API 响应头"
-            if "tpm" in header_info and isinstance(header_info["tpm"], int):
-                entry["tpm"] = header_info["tpm"]
-            if "rpd" in header_info and isinstance(header_info["rpd"], int):
-                entry["rpd"] = header_info["rpd"]
-        except Exception:
-            pass
-
-        # 第 2 步: 回退至已知参考限额
-        if entry["rpm"] is None:
-            if name in KNOWN_FREE_LIMITS:
-                known = KNOWN_FREE_LIMITS[name]
-                entry["rpm"] = known.get("rpm")
-                entry["tpm"] = known.get("tpm")
-                entry["rpd"] = known.get("rpd")
-                entry["source"] = "参考值 (Google 官方)"
-            else:
-                # 尝试前缀匹配
-                for known_name, known_limits in KNOWN_FREE_LIMITS.items():
-                    if name.startswith(known_name) or known_name.startswith(name):
-                        entry["rpm"] = known_limits.get("rpm")
-                        entry["tpm"] = known_limits.get("tpm")
-                        entry["rpd"] = known_limits.get("rpd")
-                        entry["source"] = "参考值 (近似匹配)"
-                        break
-
-        # 第 3 步: 计算每日最大输出吞吐量
-        output_limit = entry.get("outputTokenLimit") or 0
-        rpd = entry.get("rpd") or 0
-        tpm = entry.get("tpm") or 0
-
-        daily_by_rpd = rpd * output_limit if rpd else None
-        daily_by_tpm = tpm * 1440 if tpm else None  # 1440 分钟/天
-
-        if daily_by_rpd and daily_by_tpm:
-            entry["daily_max_output"] = min(daily_by_rpd, daily_by_tpm)
-        elif daily_by_rpd:
-            entry["daily_max_output"] = daily_by_rpd
-        elif daily_by_tpm:
-            entry["daily_max_output"] = daily_by_tpm
-        else:
-            entry["daily_max_output"] = None
-
+        header_info = rate_headers.get(name)
+        if header_info is None and not (cancel is not None and cancel.cancelled):
+            # 发送轻量请求，捕获响应头 (由自适应限速器控制节奏)
+            try:
+                with rate_limited(provider_name, name, api_key=api_key):
+                    if api_format == FORMAT_GEMINI:
+                        url = f"{base_url}/{name}:generateContent?key={api_key}"
+                        payload = {"contents": [{"parts": [{"text": "Hi"}]}],
+                                   "generationConfig": {"maxOutputTokens": 1}}
+                        resp = _session.post(url, json=payload, timeout=30)
+                    else:
+                        model_id = model.get("_model_id") or name.replace("models/", "")
+                        payload = {"model": model_id,
+                                   "messages": [{"role": "user", "content": "Hi"}],
+                                   "max_tokens": 1}
+                        resp = _session.post(f"{base_url}/chat/completions", json=payload,
+                                             headers={"Authorization": f"Bearer {api_key}",
+                                                      "Content-Type": "application/json"},
+                                             timeout=30)
+                header_info = parse_rate_limit_headers(dict(resp.headers))
+            except Exception:
+                pass
+
+        entry = build_quota_entry(model, header_info)
         quota_data[name] = entry
-
-        if i % 3 == 0:
-            time.sleep(0.2)
+        emit_event("quota_result", model=name, rpm=entry["rpm"], tpm=entry["tpm"],
+                   rpd=entry["rpd"], daily_max_output=entry["daily_max_output"],
+                   source=entry["source"])
 
     clear_line()
     print(c(f"  ✅ 已检测 {len(quota_data)} 个可用模型的配额", C.GREEN + C.BOLD))
@@ -1442,6 +2478,9 @@ def print_quota_report(quota_data):
         if len(display) > 24:
             display = display[:22] + ".."
         rpm_s = str(entry.get("rpm")) if entry.get("rpm") is not None else "?"
+        floor = entry.get("measured_rpm_min")
+        if floor and (entry.get("rpm") is None or floor > entry["rpm"]):
+            rpm_s = f"≥{floor}"
         tpm_s = fmt_tokens(entry.get("tpm")) if entry.get("tpm") else "?"
         rpd_s = str(entry.get("rpd")) if entry.get("rpd") is not None else "?"
         out_s = fmt_tokens(entry.get("outputTokenLimit"))
@@ -1469,6 +2508,10 @@ def print_quota_report(quota_data):
     print(f"  {c('📌 数据来源:', C.DIM)} ", end="")
     if "API 响应头" in sources:
         print(c("⚡ = API 实时响应头", C.CYAN), end="  ")
+    if any("实测" in s for s in sources):
+        print(c("实测 = 负载探测结果", C.GREEN), end="  ")
+    if any(e.get("measured_rpm_min") for e in quota_data.values()):
+        print(c("≥ = 负载探测实测下限 (未触发 429)", C.GREEN), end="  ")
     if any("参考" in s for s in sources):
         print(c("其余 = Google 官方文档参考值 (免费层)", C.GRAY), end="")
     print()
@@ -1495,7 +2538,7 @@ def prompt_token_calculator(quota_data):
         return
 
     try:
-        raw = input(c("  📝 输入你需要的总 Token 数 (例: 10000000 或 10M，直接回车跳过): ",
+        raw = ask(c("  📝 输入你需要的总 Token 数 (例: 10000000 或 10M，直接回车跳过): ",
                       C.BOLD + C.WHITE)).strip()
     except (EOFError, KeyboardInterrupt):
         return
@@ -1577,9 +2620,398 @@ def prompt_token_calculator(quota_data):
 
     print()
 
+# ─── 流式吞吐基准测试 ─────────────────────────────────────────
+
+BENCH_OUTPUT_TOKENS = 256   # 基准测试要求的固定输出长度
+BENCH_WORKERS = 4           # 基准测试并发数 (过高会互相干扰测速)
+BENCH_TIMEOUT = 60
+BENCH_PROMPT = "Count from 1 to 1000 in English words, separated by commas. Do not stop early."
+
+
+def _parse_stream_chunk(obj, api_format):
+    """解析一个流式分片，返回 (输出文本, 累计输出 Token 数或 None)"""
+    if api_format == FORMAT_GEMINI:
+        text = ""
+        for cand in obj.get("candidates") or []:
+            for part in (cand.get("content") or {}).get("parts") or []:
+                text += part.get("text") or ""
+        usage = obj.get("usageMetadata") or {}
+        return text, usage.get("candidatesTokenCount")
+    text = ""
+    for choice in obj.get("choices") or []:
+        delta = choice.get("delta") or {}
+        text += (delta.get("content") or "") + (delta.get("reasoning_content") or "")
+    usage = obj.get("usage") or {}
+    return text, usage.get("completion_tokens")
+
+
+def benchmark_model(base_url, api_key, model, api_format, max_tokens=BENCH_OUTPUT_TOKENS):
+    """以流式请求固定长度的输出，测量首 Token 延迟 (TTFT)、Token 间隔分位数与输出速度。
+    Token 间隔按流式分片计算；服务商返回 usage 时输出 Token 数以 usage 为准，
+    否则按分片计数 (token_source 为 "chunks")。
+    失败时返回 {"error": 中文错误信息}"""
+    name = model["name"]
+    if api_format == FORMAT_GEMINI:
+        url = f"{base_url}/{name}:streamGenerateContent?alt=sse&key={api_key}"
+        payload = {"contents": [{"parts": [{"text": BENCH_PROMPT}]}],
+                   "generationConfig": {"maxOutputTokens": max_tokens}}
+        headers = {}
+    else:
+        model_id = model.get("_model_id") or name.replace("models/", "")
+        url = f"{base_url}/chat/completions"
+        payload = {"model": model_id,
+                   "messages": [{"role": "user", "content": BENCH_PROMPT}],
+                   "max_tokens": max_tokens,
+                   "stream": True,
+                   # 不加此项时 OpenAI 及多数兼容服务商不在流中返回 usage
+                   "stream_options": {"include_usage": True}}
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    t0 = time.perf_counter()
+    try:
+        resp = _session.post(url, json=payload, headers=headers,
+                             timeout=BENCH_TIMEOUT, stream=True)
+        if resp.status_code == 400 and "stream_options" in payload:
+            # 个别兼容服务商不认识 stream_options，去掉后重试 (此时按分片计数)
+            resp.close()
+            payload.pop("stream_options")
+            t0 = time.perf_counter()
+            resp = _session.post(url, json=payload, headers=headers,
+                                 timeout=BENCH_TIMEOUT, stream=True)
+    except requests.exceptions.Timeout:
+        return {"error": "请求超时"}
+    except requests.exceptions.RequestException as e:
+        return {"error": f"网络连接失败: {str(e)[:40]}"}
+
+    arrivals = []
+    usage_tokens = None
+    with resp:
+        if resp.status_code != 200:
+            try:
+                err = resp.json().get("error", {})
+            except ValueError:
+                err = {}
+            raw_msg = err.get("message", "") if isinstance(err, dict) else str(err)
+            return {"error": translate_error(resp.status_code, raw_msg)[:60]}
+        try:
+            for line in resp.iter_lines():
+                if not line or not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                try:
+                    obj = json.loads(data)
+                except ValueError:
+                    continue
+                text, tokens = _parse_stream_chunk(obj, api_format)
+                if tokens:
+                    usage_tokens = tokens
+                if text:
+                    arrivals.append(time.perf_counter())
+        except requests.exceptions.RequestException as e:
+            if not arrivals:
+                return {"error": f"流式读取失败: {str(e)[:40]}"}
+
+    if not arrivals:
+        return {"error": "未收到任何输出"}
+
+    gaps = [(b - a) * 1000 for a, b in zip(arrivals, arrivals[1:])]
+    output_tokens = usage_tokens or len(arrivals)
+    gen_seconds = arrivals[-1] - arrivals[0]
+    tps = (output_tokens - 1) / gen_seconds if gen_seconds > 0 and output_tokens > 1 else None
+
+    def ms(v):
+        return round(v, 1) if v is not None else None
+
+    return {
+        "ttft_ms": ms((arrivals[0] - t0) * 1000),
+        "itl_p50_ms": ms(percentile(gaps, 50)),
+        "itl_p95_ms": ms(percentile(gaps, 95)),
+        "itl_p99_ms": ms(percentile(gaps, 99)),
+        "output_tokens": output_tokens,
+        "tokens_per_sec": ms(tps),
+        "total_ms": ms((time.perf_counter() - t0) * 1000),
+        "token_source": "usage" if usage_tokens else "chunks",
+    }
+
+
+def run_benchmarks(base_url, api_key, models, test_results, api_format, provider_name="",
+                   max_tokens=BENCH_OUTPUT_TOKENS, workers=BENCH_WORKERS, rate=None,
+                   cancel=None):
+    """对所有可用的文本生成模型运行流式基准测试，返回 {name: 结果}
+    cancel (CancelToken) 被取消 (或累计 KEY_FATAL_THRESHOLD 个密钥级错误) 后，
+    尚未开始的模型不再测试。"""
+    gen_models = [m for m in models
+                  if test_results.get(m["name"], (None,))[0] is True
+                  and "generateContent" in m.get("supportedGenerationMethods", [])]
+    if not gen_models:
+        return {}
+
+    print()
+    print(c(f"  ⏳ 正在进行流式吞吐基准测试 (每个模型输出 {max_tokens} tokens)...", C.CYAN))
+    print()
+
+    bench_data = {}
+    cancel = cancel or CancelToken()
+    key_failures = []
+
+    def task(model):
+        if cancel.cancelled:
+            return {"error": f"已跳过: {cancel.reason}"}
+        with rate_limited(provider_name, model["name"], rate, api_key) as slot:
+            if cancel.cancelled:
+                return {"error": f"已跳过: {cancel.reason}"}
+            result = benchmark_model(base_url, api_key, model, api_format, max_tokens)
+        if result.get("error") and is_key_level_error(slot["status"], result["error"]):
+            key_failures.append(model["name"])
+            if len(key_failures) >= KEY_FATAL_THRESHOLD:
+                cancel.cancel(f"密钥不可用 ({result['error']})")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(task, m): m for m in gen_models}
+        try:
+            for done, fut in enumerate(as_completed(futures), 1):
+                model = futures[fut]
+                try:
+                    entry = fut.result()
+                except Exception as e:
+                    entry = {"error": str(e)[:50]}
+                entry["name"] = model["name"]
+                entry["displayName"] = model.get("displayName", model["name"].replace("models/", ""))
+                bench_data[model["name"]] = entry
+                progress_bar(done, len(gen_models), label=entry["displayName"])
+                emit_event("bench_result", model=model["name"],
+                           **{k: v for k, v in entry.items() if k not in ("name", "displayName")})
+        except BaseException:
+            cancel.cancel("已中止")
+            raise
+
+    clear_line()
+    ok = sum(1 for e in bench_data.values() if not e.get("error"))
+    print(c(f"  ✅ 已完成 {ok}/{len(bench_data)} 个模型的基准测试", C.GREEN + C.BOLD))
+    return bench_data
+
+
+def print_benchmark_report(bench_data, quota_data=None):
+    """打印基准测试排行 (按输出速度降序)，并附上配额推算的每日最大吞吐"""
+    ranked = sorted((e for e in bench_data.values() if not e.get("error")),
+                    key=lambda e: e.get("tokens_per_sec") or 0, reverse=True)
+    if not ranked:
+        return
+
+    def num(v, fmt="{:.0f}"):
+        return fmt.format(v) if v is not None else "?"
+
+    print()
+    print(c("  ╔═══════════════════════════════════════════════════════════════════════════╗", C.MAGENTA))
+    print(c("  ║", C.MAGENTA) + c("                      🏎️  流式输出速度基准测试                           ", C.BOLD) + c("║", C.MAGENTA))
+    print(c("  ╚═══════════════════════════════════════════════════════════════════════════╝", C.MAGENTA))
+    print()
+    hdr = (f"  {'排名':>4s}  {'模型名称':<26s}  {'TTFT':>7s}  {'间隔p50':>7s}  {'p95':>6s}  "
+           f"{'p99':>6s}  {'tok/s':>7s}  {'每日最大吞吐':>12s}")
+    print(c(hdr, C.BOLD))
+    divider("─", 90)
+    for idx, e in enumerate(ranked, 1):
+        display = e["displayName"]
+        if len(display) > 24:
+            display = display[:22] + ".."
+        daily = (quota_data or {}).get(e["name"], {}).get("daily_max_output")
+        daily_s = fmt_tokens(daily) if daily else "?"
+        tps_s = num(e.get("tokens_per_sec"), "{:.1f}")
+        if e.get("token_source") == "chunks":
+            tps_s += "*"
+        nc = C.GREEN + C.BOLD if idx <= 3 else C.WHITE
+        print(f"  {idx:>4d}  {c(f'{display:<26s}', nc)}  {num(e.get('ttft_ms')):>5s}ms  "
+              f"{num(e.get('itl_p50_ms')):>5s}ms  {num(e.get('itl_p95_ms')):>4s}ms  "
+              f"{num(e.get('itl_p99_ms')):>4s}ms  {c(f'{tps_s:>7s}', nc)}  {daily_s:>12s}")
+    failed = [e for e in bench_data.values() if e.get("error")]
+    print()
+    divider("─", 90)
+    print(f"  {c('💡 TTFT = 首 Token 延迟；间隔 = 相邻流式分片的到达间隔；tok/s = 首 Token 之后的输出速度', C.DIM)}")
+    if any(e.get("token_source") == "chunks" for e in ranked):
+        print(f"  {c('   * 服务商未返回 usage，按流式分片数计算 (分片/s，一个分片可能包含多个 Token)', C.DIM)}")
+    if failed:
+        print(f"  {c(f'⚠️  {len(failed)} 个模型基准测试失败 (不支持流式或请求出错)', C.YELLOW)}")
+    print()
+
+
+# ─── 负载探测 ────────────────────────────────────────────────
+
+LOAD_LEVELS = (1, 2, 4, 8, 16, 32, 64)   # 逐级提升的并发数
+LOAD_LEVEL_SECONDS = 10                  # 每个并发级别持续时间
+LOAD_MAX_TOKENS = 16                     # 每次请求的输出上限
+LOAD_KNEE_GAIN = 0.10                    # 吞吐提升低于 10% 视为到达拐点
+
+
+def _load_request(base_url, api_key, model, api_format):
+    """发送一次负载探测请求，返回 (HTTP 状态码或 None, 延迟 ms, 消耗 Token 数)"""
+    t0 = time.perf_counter()
+    try:
+        if api_format == FORMAT_GEMINI:
+            url = f"{base_url}/{model['name']}:generateContent?key={api_key}"
+            payload = {"contents": [{"parts": [{"text": "Say OK"}]}],
+                       "generationConfig": {"maxOutputTokens": LOAD_MAX_TOKENS}}
+            status, data = api_request(url, data=payload)
+            tokens = (data.get("usageMetadata") or {}).get("totalTokenCount") or 0
+        else:
+            model_id = model.get("_model_id") or model["name"].replace("models/", "")
+            payload = {"model": model_id,
+                       "messages": [{"role": "user", "content": "Say OK"}],
+                       "max_tokens": LOAD_MAX_TOKENS}
+            status, data, _ = openai_api_request(f"{base_url}/chat/completions",
+                                                 api_key, data=payload)
+            tokens = (data.get("usage") or {}).get("total_tokens") or 0
+    except ConnectionError:
+        status, tokens = None, 0
+    return status, (time.perf_counter() - t0) * 1000, tokens
+
+
+def _run_load_level(base_url, api_key, model, api_format, concurrency, seconds):
+    """以固定并发持续发送请求 seconds 秒，返回该级别的统计"""
+    deadline = time.monotonic() + seconds
+    lock = threading.Lock()
+    samples = []
+
+    def worker():
+        while time.monotonic() < deadline:
+            sample = _load_request(base_url, api_key, model, api_format)
+            with lock:
+                samples.append(sample)
+
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = max(time.monotonic() - t0, 0.001)
+
+    ok = [s for s in samples if s[0] == 200]
+    latencies = [s[1] for s in ok]
+
+    def ms(v):
+        return round(v, 1) if v is not None else None
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "success": len(ok),
+        "rate_limited": sum(1 for s in samples if s[0] == 429),
+        "errors": sum(1 for s in samples if s[0] not in (200, 429)),
+        "rpm": round(len(ok) / elapsed * 60, 1),
+        "tpm": round(sum(s[2] for s in ok) / elapsed * 60),
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+    }
+
+
+def run_load_probe(base_url, api_key, model, api_format, max_concurrency=32,
+                   seconds=LOAD_LEVEL_SECONDS):
+    """对单个模型逐级提升并发，直到出现 429 或达到 max_concurrency。
+    记录每一级实测的 RPM / TPM / 延迟分位数，并找出吞吐拐点：
+    出现 429 之前、继续加并发吞吐提升不足 LOAD_KNEE_GAIN 的那一级。"""
+    display = model.get("displayName", model["name"].replace("models/", ""))
+    levels = [n for n in LOAD_LEVELS if n <= max_concurrency] or [1]
+
+    print()
+    print(c(f"  ⏳ 正在对 {display} 进行负载探测 (并发 {levels[0]}→{levels[-1]}，每级 {seconds}s)...", C.CYAN))
+    print(c("     ⚠️  该模式会持续发送请求直到触发限流，将消耗配额", C.YELLOW))
+    print()
+
+    results = []
+    for concurrency in levels:
+        progress_bar(len(results), len(levels), label=f"并发 {concurrency}")
+        level = _run_load_level(base_url, api_key, model, api_format, concurrency, seconds)
+        results.append(level)
+        emit_event("load_level", model=model["name"], **level)
+        if level["rate_limited"] or not level["success"]:
+            break
+    clear_line()
+
+    knee = None
+    for prev, cur in zip(results, results[1:]):
+        if cur["rate_limited"] or prev["rpm"] <= 0 or (cur["rpm"] - prev["rpm"]) / prev["rpm"] < LOAD_KNEE_GAIN:
+            knee = prev
+            break
+    if knee is None and results and not results[-1]["rate_limited"]:
+        knee = results[-1]
+
+    probe = {"name": model["name"], "displayName": display, "levels": results,
+             "knee": knee, "hit_rate_limit": any(r["rate_limited"] for r in results)}
+    emit_event("load_probe_done", model=model["name"], knee=knee,
+               hit_rate_limit=probe["hit_rate_limit"])
+    return probe
+
+
+def apply_load_probe_to_quota(probe, quota_data):
+    """响应头未提供限额时，用负载探测的实测值替换参考值。
+    未触发 429 时实测吞吐只是受并发上限与延迟约束的下限，记为 measured_rpm_min，保留参考值。"""
+    knee = probe.get("knee")
+    entry = quota_data.get(probe["name"])
+    if not knee or entry is None or entry.get("source") == "API 响应头":
+        return
+    # 触发 429 的级别吞吐不可持续，取最高一个未被限流的并发级别
+    sustained = [r for r in probe["levels"] if not r["rate_limited"] and r["success"]]
+    if not sustained:
+        return
+    peak = sustained[-1]
+    if not probe["hit_rate_limit"]:
+        entry["measured_rpm_min"] = int(peak["rpm"])
+        entry["measured_source"] = "实测下限 (负载探测未触发 429)"
+        return
+    entry["rpm"] = int(peak["rpm"])
+    entry["tpm"] = int(peak["tpm"]) or entry.get("tpm")
+    entry["source"] = "实测 (负载探测)"
+    entry["daily_max_output"] = compute_daily_max_output(entry)
+
+
+def print_load_probe_report(probe):
+    """打印负载探测各并发级别的结果与拐点"""
+    if not probe or not probe["levels"]:
+        return
+
+    def num(v):
+        return f"{v:.0f}" if v is not None else "?"
+
+    print()
+    print(c(f"  📈 负载探测结果: {probe['displayName']}", C.BOLD))
+    divider("─", 82)
+    print(c(f"  {'并发':>4s}  {'请求':>5s}  {'成功':>5s}  {'429':>4s}  {'错误':>4s}  "
+            f"{'RPM':>7s}  {'TPM':>8s}  {'p50':>7s}  {'p95':>7s}  {'p99':>7s}", C.GRAY))
+    for r in probe["levels"]:
+        is_knee = probe.get("knee") is r
+        color = C.GREEN + C.BOLD if is_knee else (C.RED if r["rate_limited"] else C.WHITE)
+        rpm_s, tpm_s = num(r["rpm"]), fmt_tokens(r["tpm"])
+        line = (f"  {r['concurrency']:>4d}  {r['requests']:>5d}  {r['success']:>5d}  "
+                f"{r['rate_limited']:>4d}  {r['errors']:>4d}  {rpm_s:>7s}  {tpm_s:>8s}  "
+                f"{num(r['p50_ms']):>5s}ms  {num(r['p95_ms']):>5s}ms  {num(r['p99_ms']):>5s}ms")
+        print(c(line, color) + (c("  ← 拐点", C.GREEN) if is_knee else ""))
+    divider("─", 82)
+    knee = probe.get("knee")
+    if knee:
+        print(f"  {c('🎯 吞吐拐点:', C.BOLD)} 并发 {knee['concurrency']}，"
+              f"实测 ~{num(knee['rpm'])} RPM / ~{fmt_tokens(knee['tpm'])} TPM")
+    if not probe["hit_rate_limit"]:
+        print(c("  💡 在最大并发下仍未触发 429，实际限额可能更高 (可调大 --load-max)", C.DIM))
+    print()
+
+
 # ─── 可视化输出 ───────────────────────────────────────────────
 
-def print_model_row(model, test_result=None, idx=0):
+def fmt_latency(latency):
+    """格式化延迟分解，例: 820ms (DNS 12 · 连接 35 · TLS 60 · 首字节 700)"""
+    if not latency:
+        return ""
+    if latency.get("reused"):
+        return f"{latency['total']:.0f}ms (复用连接 · 首字节 {latency['ttfb']:.0f})"
+    return (f"{latency['total']:.0f}ms (DNS {latency['dns']:.0f} · 连接 {latency['connect']:.0f}"
+            f" · TLS {latency['tls']:.0f} · 首字节 {latency['ttfb']:.0f})")
+
+
+def print_model_row(model, test_result=None, idx=0, latency=None):
     """打印一行模型信息"""
     display = model.get("displayName", "")
     model_id = model.get("name", "").replace("models/", "")
@@ -1628,6 +3060,8 @@ def print_model_row(model, test_result=None, idx=0):
         elif ok is False:
             print(f"  {c(msg[:45], C.RED)}", end="")
     print()
+    if latency:
+        print(f"         {c('⏱ ' + fmt_latency(latency), C.GRAY)}")
     print()
 
 def print_summary(models, test_results):
@@ -1669,8 +3103,23 @@ def print_summary(models, test_results):
     print(c("  ╚═══════════════════════════════════════════════════════════════╝", C.BLUE))
     print()
 
-def export_json(api_key, base_url, models, test_results, quota_data=None):
-    """导出结果到 JSON (包含配额分析)"""
+def _bench_rate_fields(entry):
+    """基准测试的输出量与速度字段：没有 usage 时按分片计数，导出为 outputChunks / chunksPerSec"""
+    if entry.get("token_source") == "chunks":
+        return {"outputChunks": entry.get("output_tokens"),
+                "chunksPerSec": entry.get("tokens_per_sec")}
+    return {"outputTokens": entry.get("output_tokens"),
+            "tokensPerSec": entry.get("tokens_per_sec")}
+
+
+def build_export_data(api_key, base_url, models, test_results, quota_data=None,
+                      latencies=None, bench_data=None, load_probe=None, tested_at=None,
+                      statuses=None):
+    """构建导出用的结果字典 (单个密钥的完整报告)
+    tested_at 为 {name: 测试时间} (增量复测沿用的旧结果)，未给出的模型记为本次测试时间；
+    statuses 为 run_model_tests 记录的 {name: HTTP 状态码}。"""
+    tested_at = tested_at or {}
+    statuses = statuses or {}
     export_data = {
         "api_key_prefix": api_key[:8] + "..." if len(api_key) > 8 else "***",
         "base_url": base_url,
@@ -1691,7 +3140,20 @@ def export_json(api_key, base_url, models, test_results, quota_data=None):
         }
         if model.get("name") in test_results:
             s, msg = test_results[model["name"]]
-            info["testResult"] = {"available": s, "message": msg}
+            info["testResult"] = {"available": s, "message": msg,
+                                  "status": statuses.get(model["name"]),
+                                  "testedAt": tested_at.get(model["name"],
+                                                           export_data["test_time"])}
+        if latencies and model.get("name") in latencies:
+            lat = latencies[model["name"]]
+            info["latency"] = {
+                "dnsMs": lat.get("dns"),
+                "connectMs": lat.get("connect"),
+                "tlsMs": lat.get("tls"),
+                "ttfbMs": lat.get("ttfb"),
+                "totalMs": lat.get("total"),
+                "reusedConnection": lat.get("reused"),
+            }
         # 附加配额信息
         if quota_data and model.get("name") in quota_data:
             q = quota_data[model["name"]]
@@ -1701,6 +3163,18 @@ def export_json(api_key, base_url, models, test_results, quota_data=None):
                 "rpd": q.get("rpd"),
                 "dailyMaxOutput": q.get("daily_max_output"),
                 "source": q.get("source"),
+                "measuredRpmMin": q.get("measured_rpm_min"),
+            }
+        # 附加基准测试结果
+        if bench_data and model.get("name") in bench_data:
+            b = bench_data[model["name"]]
+            info["benchmark"] = {
+                "ttftMs": b.get("ttft_ms"),
+                "itlP50Ms": b.get("itl_p50_ms"),
+                "itlP95Ms": b.get("itl_p95_ms"),
+                "itlP99Ms": b.get("itl_p99_ms"),
+                **_bench_rate_fields(b),
+                "error": b.get("error"),
             }
         export_data["models"].append(info)
 
@@ -1720,21 +3194,903 @@ def export_json(api_key, base_url, models, test_results, quota_data=None):
                 "outputTokenLimit": e.get("outputTokenLimit"),
                 "dailyMaxOutput": e.get("daily_max_output"),
                 "source": e.get("source"),
+                "measuredRpmMin": e.get("measured_rpm_min"),
+            }
+            for i, e in enumerate(ranked)
+        ]
+    # 输出速度排行摘要
+    if bench_data:
+        ranked = sorted((e for e in bench_data.values() if not e.get("error")),
+                        key=lambda e: e.get("tokens_per_sec") or 0, reverse=True)
+        export_data["benchmarkRanking"] = [
+            {
+                "rank": i + 1,
+                "name": e["name"],
+                "displayName": e["displayName"],
+                "ttftMs": e.get("ttft_ms"),
+                **_bench_rate_fields(e),
+                "dailyMaxOutput": (quota_data or {}).get(e["name"], {}).get("daily_max_output"),
             }
             for i, e in enumerate(ranked)
         ]
 
+    # 负载探测
+    if load_probe:
+        export_data["loadProbe"] = {
+            "name": load_probe["name"],
+            "hitRateLimit": load_probe["hit_rate_limit"],
+            "knee": load_probe["knee"],
+            "levels": load_probe["levels"],
+        }
+    return export_data
+
+
+def export_json(api_key, base_url, models, test_results, quota_data=None, latencies=None,
+                bench_data=None, load_probe=None, tested_at=None, statuses=None):
+    """导出结果到 JSON (包含配额分析、延迟分解、基准测试与负载探测)"""
+    export_data = build_export_data(api_key, base_url, models, test_results, quota_data,
+                                    latencies, bench_data, load_probe, tested_at, statuses)
     filename = f"api_test_{time.strftime('%Y%m%d_%H%M%S')}.json"
     with open(filename, "w", encoding="utf-8") as f:
         json.dump(export_data, f, ensure_ascii=False, indent=2)
     return filename
 
+# ─── 增量复测 (--since) ──────────────────────────────────────
+
+SINCE_MAX_AGE_HOURS = 168    # 沿用的旧结果超过此时长 (小时) 后重新测试
+
+# 临时性失败 (限流 / 服务端错误 / 超时)：下次运行需要重新测试
+TRANSIENT_STATUSES = (408, 429, 500, 502, 503, 504, 529)
+TRANSIENT_ERRORS = {ERROR_TRANSLATIONS[s] for s in TRANSIENT_STATUSES} | {
+    translate_error(0, kw) for kw in ("rate limit", "quota exceeded", "server error",
+                                      "internal error", "overloaded", "timeout")}
+# Gemini 原始错误信息中的临时性错误 (translate_error 不翻译这些信息)
+TRANSIENT_KEYWORDS = ("resource has been exhausted", "service is currently unavailable",
+                      "deadline exceeded")
+
+
+def parse_report_time(text, default=None):
+    """解析导出报告中的时间字符串 (本地时间 "%Y-%m-%d %H:%M:%S")，返回时间戳"""
+    try:
+        return time.mktime(time.strptime(text, "%Y-%m-%d %H:%M:%S"))
+    except (TypeError, ValueError):
+        return default
+
+
+def is_transient_error(message, status=None):
+    """判断上次的失败是否属于临时性错误。优先按记录的 HTTP 状态码判断；
+    旧导出文件没有状态码时按信息文本推断 (OpenAI 兼容服务商的信息已是
+    translate_error 译文，Gemini 为原始英文信息)。"""
+    if status is not None:
+        return status in TRANSIENT_STATUSES or status >= 500
+    message = message or ""
+    if message in TRANSIENT_ERRORS or translate_error(0, message) in TRANSIENT_ERRORS:
+        return True
+    if any(kw in message.lower() for kw in TRANSIENT_KEYWORDS):
+        return True
+    if message.startswith(("网络连接失败", "代理连接失败", "请求超时", "请求异常", "已跳过")):
+        return True
+    return message.startswith("HTTP ") and message[5:8] in {str(s) for s in TRANSIENT_STATUSES}
+
+
+def load_previous_results(path, api_key):
+    """读取上一次 export_json 的导出文件，返回 {name: 模型记录}。
+    文件不存在、格式错误或属于其他密钥时返回 None。"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(c(f"  ⚠️  无法读取 {path}: {e}，将完整测试", C.YELLOW))
+        return None
+    prefix = api_key[:8] + "..." if len(api_key) > 8 else "***"
+    if not isinstance(data, dict) or data.get("api_key_prefix") != prefix:
+        print(c(f"  ⚠️  {path} 不是该密钥的导出结果，将完整测试", C.YELLOW))
+        return None
+    previous = {}
+    for info in data.get("models", []):
+        result = info.get("testResult")
+        if not info.get("name") or not result:
+            continue
+        previous[info["name"]] = dict(info, testedAt=result.get("testedAt") or data.get("test_time"))
+    return previous
+
+
+def plan_incremental_tests(models, previous, max_age_hours=SINCE_MAX_AGE_HOURS):
+    """对比当前模型列表与上次结果，返回 (需复测的模型, 沿用结果, 沿用结果的测试时间, 原因统计)。
+    需复测: 新模型、上次临时性失败的模型、结果超过 max_age_hours 的模型；其余沿用。"""
+    to_test, carried, tested_at = [], {}, {}
+    reasons = {"new": 0, "transient": 0, "stale": 0, "carried": 0}
+    now = time.time()
+    for model in models:
+        prev = previous.get(model.get("name"))
+        if prev is None:
+            reasons["new"] += 1
+            to_test.append(model)
+            continue
+        result = prev["testResult"]
+        age = now - parse_report_time(prev["testedAt"], 0)
+        if age > max_age_hours * 3600:
+            reasons["stale"] += 1
+            to_test.append(model)
+        elif (result.get("available") is not True
+              and is_transient_error(result.get("message"), result.get("status"))):
+            reasons["transient"] += 1
+            to_test.append(model)
+        else:
+            reasons["carried"] += 1
+            carried[model["name"]] = (result.get("available"), result.get("message") or "")
+            tested_at[model["name"]] = prev["testedAt"]
+    return to_test, carried, tested_at, reasons
+
+
+def carried_rate_headers(previous, carried):
+    """把沿用模型上次的配额结果转换为 fetch_all_quotas 可复用的限流信息，避免为其重新请求"""
+    headers = {}
+    for name in carried:
+        quota = previous[name].get("quota") or {}
+        if quota.get("source") == "API 响应头":
+            headers[name] = {k: quota.get(k) for k in ("rpm", "tpm", "rpd")}
+        else:
+            headers[name] = {}  # 回退至已知参考限额
+    return headers
+
+
+def carried_latencies(previous, carried):
+    """沿用模型上次记录的延迟分解 (转换回 LatencyRecorder.as_dict 格式)，使新报告中不缺失延迟"""
+    latencies = {}
+    for name in carried:
+        lat = previous[name].get("latency")
+        if lat:
+            latencies[name] = {"dns": lat.get("dnsMs"), "connect": lat.get("connectMs"),
+                               "tls": lat.get("tlsMs"), "ttfb": lat.get("ttfbMs"),
+                               "total": lat.get("totalMs"), "reused": lat.get("reusedConnection")}
+    return latencies
+
+
+# ─── 本地结果库 (SQLite) ─────────────────────────────────────
+
+RESULTS_DB_FILE = os.path.join(CACHE_DIR, "results.db")
+TRENDS_DAYS = 30             # trends 子命令默认统计的天数
+
+_RESULTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS keys (
+    id          INTEGER PRIMARY KEY,
+    key_hash    TEXT NOT NULL UNIQUE,
+    key_prefix  TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id           INTEGER PRIMARY KEY,
+    key_id       INTEGER NOT NULL REFERENCES keys (id),
+    provider     TEXT,
+    base_url     TEXT,
+    started_at   REAL NOT NULL,
+    total_models INTEGER,
+    available    INTEGER,
+    unavailable  INTEGER,
+    error        TEXT
+);
+CREATE TABLE IF NOT EXISTS models (
+    id    INTEGER PRIMARY KEY,
+    name  TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id     INTEGER NOT NULL REFERENCES runs (id),
+    model_id   INTEGER NOT NULL REFERENCES models (id),
+    available  INTEGER,
+    status     INTEGER,
+    message    TEXT,
+    tested_at  REAL NOT NULL,
+    carried    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (run_id, model_id)
+);
+CREATE TABLE IF NOT EXISTS latencies (
+    run_id      INTEGER NOT NULL REFERENCES runs (id),
+    model_id    INTEGER NOT NULL REFERENCES models (id),
+    dns_ms      REAL,
+    connect_ms  REAL,
+    tls_ms      REAL,
+    ttfb_ms     REAL,
+    total_ms    REAL,
+    reused      INTEGER,
+    PRIMARY KEY (run_id, model_id)
+);
+CREATE TABLE IF NOT EXISTS quotas (
+    run_id            INTEGER NOT NULL REFERENCES runs (id),
+    model_id          INTEGER NOT NULL REFERENCES models (id),
+    rpm               INTEGER,
+    tpm               INTEGER,
+    rpd               INTEGER,
+    daily_max_output  INTEGER,
+    source            TEXT,
+    PRIMARY KEY (run_id, model_id)
+);
+CREATE INDEX IF NOT EXISTS idx_results_model_time ON results (model_id, tested_at);
+CREATE INDEX IF NOT EXISTS idx_results_time ON results (tested_at);
+CREATE INDEX IF NOT EXISTS idx_runs_key_time ON runs (key_id, started_at);
+"""
+
+
+def open_results_db(path=RESULTS_DB_FILE):
+    """打开 (必要时创建) 结果库，返回 sqlite3 连接"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")  # 定时任务写入时 trends 查询不被阻塞
+    conn.executescript(_RESULTS_SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(results)")}
+    if "status" not in columns:  # 早期版本的结果库没有记录状态码
+        conn.execute("ALTER TABLE results ADD COLUMN status INTEGER")
+    return conn
+
+
+def _db_key_hash(conn, api_key):
+    """与识别缓存相同，用库内随机盐对密钥做 SHA-256，库中只保存该摘要"""
+    row = conn.execute("SELECT value FROM meta WHERE key = 'salt'").fetchone()
+    if row:
+        salt = row[0]
+    else:
+        salt = os.urandom(16).hex()
+        conn.execute("INSERT INTO meta (key, value) VALUES ('salt', ?)", (salt,))
+    return hashlib.sha256(f"{salt}:{api_key}".encode("utf-8")).hexdigest()
+
+
+def _db_model_ids(conn, names):
+    """返回 {模型名: id}，不存在的模型先插入"""
+    conn.executemany("INSERT OR IGNORE INTO models (name) VALUES (?)", [(n,) for n in names])
+    ids = {}
+    for i in range(0, len(names), 500):  # 受 SQLite 参数个数上限约束，分批查询
+        chunk = names[i:i + 500]
+        ids.update(conn.execute(
+            f"SELECT name, id FROM models WHERE name IN ({','.join('?' * len(chunk))})", chunk))
+    return ids
+
+
+def _insert_report(conn, api_key, report):
+    """把一份 build_export_data 报告写入结果库，返回 run id"""
+    key_hash = _db_key_hash(conn, api_key)
+    conn.execute("INSERT OR IGNORE INTO keys (key_hash, key_prefix) VALUES (?, ?)",
+                 (key_hash, report.get("api_key_prefix")))
+    key_id = conn.execute("SELECT id FROM keys WHERE key_hash = ?", (key_hash,)).fetchone()[0]
+    started = parse_report_time(report.get("test_time"), time.time())
+    run_id = conn.execute(
+        "INSERT INTO runs (key_id, provider, base_url, started_at, total_models, available,"
+        " unavailable, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (key_id, report.get("provider"), report.get("base_url"), started,
+         report.get("total_models"), report.get("available"), report.get("unavailable"),
+         report.get("error"))).lastrowid
+
+    models = [m for m in report.get("models", []) if m.get("name")]
+    ids = _db_model_ids(conn, [m["name"] for m in models])
+    results, latencies, quotas = [], [], []
+    for m in models:
+        model_id = ids[m["name"]]
+        if m.get("testResult"):
+            r = m["testResult"]
+            tested = parse_report_time(r.get("testedAt"), started)
+            available = None if r.get("available") is None else int(r["available"])
+            # 增量复测沿用的旧结果标记为 carried，趋势统计时不重复计数
+            results.append((run_id, model_id, available, r.get("status"), r.get("message"),
+                            tested, int(tested != started)))
+        if m.get("latency"):
+            lat = m["latency"]
+            reused = lat.get("reusedConnection")
+            latencies.append((run_id, model_id, lat.get("dnsMs"), lat.get("connectMs"),
+                              lat.get("tlsMs"), lat.get("ttfbMs"), lat.get("totalMs"),
+                              None if reused is None else int(reused)))
+        if m.get("quota"):
+            q = m["quota"]
+            quotas.append((run_id, model_id, q.get("rpm"), q.get("tpm"), q.get("rpd"),
+                           q.get("dailyMaxOutput"), q.get("source")))
+    conn.executemany("INSERT INTO results (run_id, model_id, available, status, message,"
+                     " tested_at, carried) VALUES (?, ?, ?, ?, ?, ?, ?)", results)
+    conn.executemany("INSERT INTO latencies VALUES (?, ?, ?, ?, ?, ?, ?, ?)", latencies)
+    conn.executemany("INSERT INTO quotas VALUES (?, ?, ?, ?, ?, ?, ?)", quotas)
+    return run_id
+
+
+def save_reports(items, db_path=RESULTS_DB_FILE):
+    """在一个事务中写入多份报告，items 为 [(api_key, report)]，返回各自的 run id"""
+    conn = open_results_db(db_path)
+    try:
+        with conn:
+            return [_insert_report(conn, api_key, report) for api_key, report in items]
+    finally:
+        conn.close()
+
+
+def load_last_run(api_key, db_path=RESULTS_DB_FILE, quiet=False):
+    """从结果库读取该密钥最近一次成功运行的结果，格式同 load_previous_results；没有时返回 None。
+    quiet=True 时不打印提示 (批量模式)。"""
+    if not os.path.exists(db_path):
+        if not quiet:
+            print(c(f"  ⚠️  结果库 {db_path} 不存在，将完整测试", C.YELLOW))
+        return None
+    conn = open_results_db(db_path)
+    try:
+        row = conn.execute(
+            "SELECT runs.id FROM runs JOIN keys ON keys.id = runs.key_id"
+            " WHERE keys.key_hash = ? AND runs.error IS NULL"
+            " ORDER BY runs.started_at DESC LIMIT 1", (_db_key_hash(conn, api_key),)).fetchone()
+        if not row:
+            if not quiet:
+                print(c("  ⚠️  结果库中没有该密钥的历史结果，将完整测试", C.YELLOW))
+            return None
+        rows = conn.execute(
+            "SELECT m.name, r.available, r.status, r.message, r.tested_at,"
+            " q.rpm, q.tpm, q.rpd, q.source,"
+            " l.dns_ms, l.connect_ms, l.tls_ms, l.ttfb_ms, l.total_ms, l.reused"
+            " FROM results r JOIN models m ON m.id = r.model_id"
+            " LEFT JOIN quotas q ON q.run_id = r.run_id AND q.model_id = r.model_id"
+            " LEFT JOIN latencies l ON l.run_id = r.run_id AND l.model_id = r.model_id"
+            " WHERE r.run_id = ?", (row[0],)).fetchall()
+    finally:
+        conn.close()
+    previous = {}
+    for (name, available, status, message, tested_at, rpm, tpm, rpd, source,
+         dns, connect, tls, ttfb, total, reused) in rows:
+        previous[name] = {
+            "name": name,
+            "testResult": {"available": None if available is None else bool(available),
+                           "status": status, "message": message},
+            "testedAt": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(tested_at)),
+            "quota": {"rpm": rpm, "tpm": tpm, "rpd": rpd, "source": source} if source else None,
+            "latency": {"dnsMs": dns, "connectMs": connect, "tlsMs": tls, "ttfbMs": ttfb,
+                        "totalMs": total,
+                        "reusedConnection": None if reused is None else bool(reused)}
+                       if total is not None else None,
+        }
+    return previous
+
+
+def query_model_availability(conn, model, days=TRENDS_DAYS):
+    """某模型近 days 天每天的 (日期, 测试次数, 可用次数)，走 results(model_id, tested_at) 索引。
+    model 可为完整名称或省略 models/ 前缀。"""
+    return conn.execute(
+        "SELECT date(r.tested_at, 'unixepoch', 'localtime') AS day, COUNT(*),"
+        " SUM(r.available = 1)"
+        " FROM results r JOIN models m ON m.id = r.model_id"
+        " WHERE m.name IN (?, ?) AND r.tested_at >= ? AND r.carried = 0"
+        " AND r.available IS NOT NULL"
+        " GROUP BY day ORDER BY day",
+        (model, f"models/{model}", time.time() - days * 86400)).fetchall()
+
+
+def query_availability_summary(conn, days=TRENDS_DAYS):
+    """近 days 天各模型的 (名称, 测试次数, 可用次数, 平均总延迟 ms, 最近测试时间)，可用率低的在前"""
+    return conn.execute(
+        "SELECT m.name, COUNT(*), SUM(r.available = 1), AVG(l.total_ms), MAX(r.tested_at)"
+        " FROM results r JOIN models m ON m.id = r.model_id"
+        " LEFT JOIN latencies l ON l.run_id = r.run_id AND l.model_id = r.model_id"
+        " WHERE r.tested_at >= ? AND r.carried = 0 AND r.available IS NOT NULL"
+        " GROUP BY m.name ORDER BY SUM(r.available = 1) * 1.0 / COUNT(*), m.name",
+        (time.time() - days * 86400,)).fetchall()
+
+
+def _availability_bar(ok, total, width=20):
+    filled = int(width * ok / total) if total else 0
+    color = C.GREEN if ok == total else (C.YELLOW if ok else C.RED)
+    return c("█" * filled, color) + c("░" * (width - filled), C.GRAY)
+
+
+def print_trends(model=None, days=TRENDS_DAYS, db_path=RESULTS_DB_FILE):
+    """trends 子命令：打印结果库中近 days 天的可用性趋势 (指定模型时按天展开)"""
+    if not os.path.exists(db_path):
+        print(c(f"  ⚠️  结果库 {db_path} 不存在，请先运行一次测试。", C.YELLOW))
+        return
+    conn = open_results_db(db_path)
+    try:
+        rows = (query_model_availability(conn, model, days) if model
+                else query_availability_summary(conn, days))
+    finally:
+        conn.close()
+
+    print()
+    divider("═")
+    title = f"📈 {model} 近 {days} 天可用性" if model else f"📈 近 {days} 天模型可用性趋势"
+    print(c(f"  {title}", C.BOLD))
+    divider("═")
+    print()
+    if not rows:
+        print(c("  (没有符合条件的测试记录)", C.GRAY))
+        print()
+        return
+
+    if model:
+        for day, total, ok in rows:
+            print(f"  {c(day, C.WHITE)}  {_availability_bar(ok, total)}  "
+                  f"{c(f'{ok}/{total}', C.BOLD)} 可用")
+    else:
+        for name, total, ok, avg_ms, last in rows:
+            latency = f"{avg_ms:.0f}ms" if avg_ms is not None else "-"
+            print(f"  {_availability_bar(ok, total)} {c(f'{ok * 100 // total:>3d}%', C.BOLD)} "
+                  f"{c(f'({ok}/{total})', C.GRAY)}  {c(name.replace('models/', ''), C.WHITE)}  "
+                  f"{c(latency, C.GRAY)}  "
+                  f"{c(time.strftime('%m-%d %H:%M', time.localtime(last)), C.DIM)}")
+    print()
+
+
+# ─── 批量密钥审计 ────────────────────────────────────────────
+
+DEFAULT_BATCH_CONCURRENCY = 32   # 所有密钥合计同时进行的测试请求上限
+BATCH_KEY_WORKERS = 8            # 同时处理的密钥数
+
+
+def load_keys_file(path):
+    """读取密钥文件，返回 [{"key": ..., "base_url": ...}]。
+    支持每行一个密钥 (可在其后空格跟自定义地址)，或 JSONL 格式
+    ({"key": "...", "base_url": "..."})；空行和 # 注释行会被跳过，重复密钥只保留一次。"""
+    entries, seen = [], set()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    continue
+                key = (obj.get("key") or obj.get("api_key") or obj.get("apiKey") or "").strip()
+                base_url = obj.get("base_url") or obj.get("baseUrl")
+            else:
+                parts = line.split()
+                key = parts[0]
+                base_url = parts[1] if len(parts) > 1 else None
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            entries.append({"key": key,
+                            "base_url": base_url.rstrip("/") if base_url else None})
+    return entries
+
+
+def detect_and_fetch_models(api_key, custom_url=None, use_cache=True):
+    """非交互地识别服务商并获取模型列表，返回 (provider, models, 错误信息)。
+    缓存的服务商认证失败时清除缓存并重新探测一次。"""
+    provider = detect_provider_quiet(api_key, custom_url, use_cache)
+    if not provider:
+        return None, [], "无法识别服务商"
+
+    for attempt in range(2):
+        try:
+            if provider["format"] == FORMAT_GEMINI:
+                models = fetch_models(provider["base_url"], api_key)
+            else:
+                models = openai_fetch_models(provider["base_url"], api_key, provider["name"])
+            return provider, models, None
+        except PermissionError as e:
+            if attempt == 0 and provider.get("_cached"):
+                invalidate_cached_provider(api_key)
+                provider = detect_provider_quiet(api_key, custom_url, use_cache=False)
+                if not provider:
+                    return None, [], "无法识别服务商"
+                continue
+            return provider, [], str(e)
+        except Exception as e:
+            return provider, [], str(e)
+
+
+def audit_key(api_key, custom_url=None, use_cache=True, workers=DEFAULT_TEST_WORKERS,
+              rate=None, semaphore=None, since_db=None, max_age_hours=SINCE_MAX_AGE_HOURS):
+    """非交互地完成单个密钥的识别 → 获取模型 → 测试，返回 build_export_data 格式的报告，
+    另附 provider 与 error 字段。
+    给出 since_db 时以结果库中该密钥最近一次的结果为基准增量复测 (--since last)。"""
+    provider, models, error = detect_and_fetch_models(api_key, custom_url, use_cache)
+    if error:
+        report = build_export_data(api_key, provider["base_url"] if provider else custom_url, [], {})
+        report["provider"] = provider["name"] if provider else None
+        report["error"] = error
+        return report
+
+    to_test, carried, carried_at = models, {}, {}
+    previous = load_last_run(api_key, since_db, quiet=True) if since_db else None
+    if previous is not None:
+        to_test, carried, carried_at, _ = plan_incremental_tests(models, previous, max_age_hours)
+    latencies = carried_latencies(previous, carried) if carried else {}
+    statuses = {name: previous[name]["testResult"].get("status") for name in carried}
+    test_results = run_model_tests(provider["base_url"], api_key, to_test, provider["format"],
+                                   provider["name"], workers=workers, rate=rate,
+                                   semaphore=semaphore, latencies=latencies, statuses=statuses)
+    if carried:
+        test_results = {m["name"]: test_results.get(m["name"]) or carried[m["name"]]
+                        for m in models}
+    report = build_export_data(api_key, provider["base_url"], models, test_results,
+                               latencies=latencies, tested_at=carried_at, statuses=statuses)
+    report["provider"] = provider["name"]
+    report["error"] = None
+    return report
+
+
+def run_key_pipeline(api_key, custom_url=None, use_cache=True, workers=DEFAULT_TEST_WORKERS,
+                     rate=None, bench=False):
+    """非交互地运行与 CLI 主流程相同的 识别 → 模型 → 测试 → 余额 → 配额 (→ 基准) 流程，
+    各阶段通过 emit_event 输出与 --json-stream 相同的事件，最后输出 report 事件。
+    返回 build_export_data 格式的报告，失败时返回 None。"""
+    emit_event("start", key_prefix=api_key[:8], custom_url=custom_url)
+    t0 = time.time()
+    provider, models, error = detect_and_fetch_models(api_key, custom_url, use_cache)
+    if provider:
+        emit_event("provider", name=provider["name"], icon=provider.get("icon"),
+                   base_url=provider["base_url"], format=provider["format"],
+                   cached=bool(provider.get("_cached")))
+    if error:
+        emit_event("error", stage="models" if provider else "provider", message=error)
+        return None
+    emit_event("models", count=len(models), seconds=round(time.time() - t0, 3),
+               names=[m.get("name") for m in models], items=models)
+
+    base_url, api_format = provider["base_url"], provider["format"]
+
+    def on_test_result(done, total, model, result, latency):
+        emit_event("model_result", model=model.get("name"), available=result[0],
+                   message=result[1], latency=latency, done=done, total=total)
+
+    t0 = time.time()
+    latencies, rate_headers, statuses = {}, {}, {}
+    cancel = CancelToken()
+    test_results = run_model_tests(base_url, api_key, models, api_format, provider["name"],
+                                   workers=workers, rate=rate, on_result=on_test_result,
+                                   latencies=latencies, cancel=cancel, rate_headers=rate_headers,
+                                   statuses=statuses)
+    emit_event("tests_done", seconds=round(time.time() - t0, 3),
+               available=sum(1 for ok, _ in test_results.values() if ok is True),
+               unavailable=sum(1 for ok, _ in test_results.values() if ok is False),
+               cancelled=cancel.reason or None)
+
+    if api_format == FORMAT_OPENAI:
+        emit_event("balance", **query_openai_balance(base_url, api_key, provider["name"],
+                                                     use_cache))
+
+    quota_data = fetch_all_quotas(base_url, api_key, models, test_results, api_format,
+                                  provider["name"], cancel, rate_headers)
+    emit_event("quota_done", count=len(quota_data))
+
+    bench_data = {}
+    if bench:
+        bench_data = run_benchmarks(base_url, api_key, models, test_results, api_format,
+                                    provider["name"], rate=rate, cancel=cancel)
+        emit_event("bench_done", count=len(bench_data))
+
+    report = build_export_data(api_key, base_url, models, test_results, quota_data,
+                               latencies, bench_data, statuses=statuses)
+    report["provider"] = provider["name"]
+    emit_event("report", report=report)
+    return report
+
+
+def run_batch_audit(keys_path, use_cache=True, workers=DEFAULT_TEST_WORKERS, rate=None,
+                    concurrency=DEFAULT_BATCH_CONCURRENCY, db_path=RESULTS_DB_FILE,
+                    export=False, since=False, max_age_hours=SINCE_MAX_AGE_HOURS):
+    """批量审计密钥文件中的所有密钥：共享一个连接池与一次代理检测，
+    多个密钥并行处理，全部测试请求受 concurrency 全局上限约束。
+    since=True 时每个密钥以结果库中自己最近一次的结果为基准增量复测。
+    全部报告在一个事务中写入结果库；export=True (或写库失败) 时另存合并 JSON 报告。
+    返回 (是否已写入结果库, JSON 文件名或 None)。"""
+    try:
+        entries = load_keys_file(keys_path)
+    except OSError as e:
+        print(c(f"  ❌ 无法读取密钥文件: {e}", C.RED))
+        safe_exit(1)
+    if not entries:
+        print(c("  ⚠️  密钥文件中没有找到任何密钥。", C.YELLOW))
+        safe_exit(0)
+
+    port, name = configure_session_proxy()
+    if port:
+        check_item("本地代理", "ok", f"http://127.0.0.1:{port} ({name})")
+    elif _session.trust_env:
+        check_item("系统代理", "ok", "使用系统代理设置")
+    else:
+        check_item("代理", "info", "未检测到代理，直接连接")
+    print()
+    print(c(f"  ⏳ 正在批量审计 {len(entries)} 个密钥 (全局并发 {concurrency})...", C.CYAN))
+    print()
+
+    semaphore = threading.BoundedSemaphore(max(1, concurrency))
+    reports = [None] * len(entries)
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=min(BATCH_KEY_WORKERS, len(entries))) as pool:
+        futures = {pool.submit(audit_key, e["key"], e["base_url"], use_cache, workers, rate,
+                               semaphore, db_path if since else None, max_age_hours): i
+                   for i, e in enumerate(entries)}
+        for done, fut in enumerate(as_completed(futures), 1):
+            i = futures[fut]
+            key = entries[i]["key"]
+            masked = f"{key[:8]}...{key[-4:]}"
+            try:
+                report = fut.result()
+            except Exception as e:
+                report = build_export_data(key, entries[i]["base_url"], [], {})
+                report["provider"] = None
+                report["error"] = f"未知错误: {str(e)[:60]}"
+            reports[i] = report
+            emit_event("key_result", key_prefix=report["api_key_prefix"],
+                       provider=report["provider"], error=report["error"],
+                       available=report["available"], total_models=report["total_models"],
+                       done=done, total=len(entries))
+            if report["error"]:
+                print(f"  {c(' ✗ ', C.RED + C.BOLD)} {c(f'[{done}/{len(entries)}]', C.GRAY)} "
+                      f"{c(masked, C.WHITE)}  {c(report['error'][:60], C.RED)}")
+            else:
+                print(f"  {c(' ✓ ', C.GREEN + C.BOLD)} {c(f'[{done}/{len(entries)}]', C.GRAY)} "
+                      f"{c(masked, C.WHITE)}  {c(report['provider'], C.CYAN)}  "
+                      f"{c(str(report['available']), C.GREEN + C.BOLD)}/{report['total_models']} 可用")
+
+    valid = sum(1 for r in reports if not r["error"])
+    print()
+    print(c(f"  ✅ 批量审计完成: {valid}/{len(reports)} 个密钥有效 ({time.time() - t0:.1f}s)",
+            C.GREEN + C.BOLD))
+
+    stored = False
+    try:
+        save_reports([(e["key"], r) for e, r in zip(entries, reports)], db_path)
+        stored = True
+    except (sqlite3.Error, OSError) as e:
+        print(c(f"  ⚠️  无法写入结果库 ({e})，改为导出 JSON", C.YELLOW))
+        export = True
+
+    filename = None
+    if export:
+        filename = f"api_batch_{time.strftime('%Y%m%d_%H%M%S')}.json"
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump({"test_time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "total_keys": len(reports),
+                       "valid_keys": valid,
+                       "keys": reports}, f, ensure_ascii=False, indent=2)
+    return stored, filename
+
+
 # ─── Web 代理服务器 ──────────────────────────────────────────
 
-def start_web_server(port=8765):
+WEB_SERVER_WORKERS = 32    # 同时处理的浏览器连接数
+WEB_MAX_INFLIGHT = 16      # 同时转发到上游 API 的最大请求数
+WEB_HOST_MAX_INFLIGHT = 8  # 同一上游主机的最大并发请求数 (也是每个主机的连接池大小)
+WEB_QUEUE_TIMEOUT = 30     # 等待上游空位的最长秒数，超时返回 503
+PROXY_CHUNK_SIZE = 64 * 1024  # 代理转发响应体的块大小 (分块上游按块到达即转发)
+PROXY_CACHE_TTL = 60          # GET 响应默认缓存秒数 (上游未给出 max-age 时)，0 = 不缓存
+PROXY_CACHE_ENTRIES = 256     # 缓存条目上限，超出后淘汰最久未使用的条目
+PROXY_CACHE_MAX_BODY = 4 * 1024 * 1024  # 超过此大小的响应体不缓存
+WEB_COMPRESS_MIN = 1024       # 小于此大小的响应不压缩
+
+try:
+    import brotli as _brotli  # 可选依赖 (pip install brotli)，缺失时只提供 gzip
+except ImportError:
+    _brotli = None
+
+
+def negotiate_encoding(accept_encoding, allow_br=True):
+    """按浏览器的 Accept-Encoding 选择压缩方式：优先 br (需安装 brotli)，其次 gzip，
+    都不接受时返回 None"""
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.partition(";")
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip())
+    if allow_br and _brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress_body(body, encoding):
+    """按 negotiate_encoding 选出的方式压缩整个响应体"""
+    if encoding == "br":
+        return _brotli.compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+
+class StaticAsset:
+    """内存中缓存的静态文件：修改时间变化时重新读取，并预先生成 gzip / br 压缩版本与 ETag"""
+
+    def __init__(self, path):
+        self.path = path
+        self.etag = None
+        self._mtime = None
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """返回 (etag, {编码: 内容})，编码 None 对应未压缩的原文"""
+        mtime = os.stat(self.path).st_mtime_ns
+        with self._lock:
+            if mtime != self._mtime:
+                with open(self.path, "rb") as f:
+                    content = f.read()
+                variants = {None: content, "gzip": gzip.compress(content, compresslevel=9)}
+                if _brotli is not None:
+                    variants["br"] = _brotli.compress(content)
+                self._variants = variants
+                self.etag = f'"{hashlib.sha256(content).hexdigest()[:16]}"'
+                self._mtime = mtime
+            return self.etag, self._variants
+
+
+class ProxyResponseCache:
+    """代理 GET 响应的内存 LRU 缓存 (线程安全)。
+    键为目标 URL 与认证头的 SHA-256 摘要，不同密钥互不共享；条目按 TTL 过期。"""
+
+    AUTH_HEADERS = ("Authorization", "x-api-key", "x-goog-api-key")
+
+    def __init__(self, max_entries=PROXY_CACHE_ENTRIES, default_ttl=PROXY_CACHE_TTL):
+        from collections import OrderedDict
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def make_key(cls, url, headers):
+        auth = "\n".join(f"{h}:{headers.get(h) or ''}" for h in cls.AUTH_HEADERS)
+        return hashlib.sha256(f"{url}\n{auth}".encode()).hexdigest()
+
+    def ttl_for(self, cache_control):
+        """按上游 Cache-Control 决定缓存时长：no-store / no-cache / max-age=0 不缓存"""
+        directives = {}
+        for part in (cache_control or "").lower().split(","):
+            name, _, value = part.strip().partition("=")
+            directives[name] = value.strip('"')
+        if "no-store" in directives or "no-cache" in directives:
+            return 0
+        for name in ("s-maxage", "max-age"):
+            if name in directives:
+                try:
+                    return max(0, int(directives[name]))
+                except ValueError:
+                    return 0
+        return self.default_ttl
+
+    def get(self, key):
+        """返回未过期的 (状态码, 响应头列表, 响应体, 缓存时刻)，未命中返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1:]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, status, headers, body, ttl):
+        with self._lock:
+            now = time.time()
+            self._entries[key] = (now + ttl, status, headers, body, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def snapshot(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+PROXY_COALESCE_WAIT = 60      # 合并请求的跟随者最多等待 leader 的秒数
+
+
+class SingleFlight:
+    """合并同时进行的相同请求 (线程安全)：同一个键只有第一个调用者 (leader) 真正回源，
+    其余调用者等待 leader 完成并共享其结果。"""
+
+    def __init__(self):
+        self.shared = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        """加入某个键的请求，返回 (是否为 leader, flight)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return False, flight
+            flight = self._flights[key] = {"done": threading.Event(), "result": None}
+            return True, flight
+
+    def resolve(self, key, flight, result):
+        """leader 完成 (result 为 None 表示失败或无法共享)，唤醒所有跟随者；重复调用无效"""
+        with self._lock:
+            if flight["done"].is_set():
+                return
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight["result"] = result
+            flight["done"].set()
+
+    def wait(self, flight, timeout=PROXY_COALESCE_WAIT):
+        """等待 leader 的结果，超时或 leader 失败时返回 None"""
+        if not flight["done"].wait(timeout) or flight["result"] is None:
+            return None
+        with self._lock:
+            self.shared += 1
+        return flight["result"]
+
+
+class UpstreamQueueTimeout(TimeoutError):
+    """在 UpstreamLimiter 中排队超时 (与 socket.timeout 区分，后者自 3.10 起也是 TimeoutError)"""
+
+
+class UpstreamLimiter:
+    """限制转发到上游的并发请求：总数不超过 total，单个主机不超过 per_host (线程安全)。
+    没有空位时排队等待，超过 timeout 秒仍未轮到则抛出 UpstreamQueueTimeout。"""
+
+    def __init__(self, total=WEB_MAX_INFLIGHT, per_host=WEB_HOST_MAX_INFLIGHT,
+                 timeout=WEB_QUEUE_TIMEOUT):
+        self.total = max(1, total)
+        self.per_host = max(1, per_host)
+        self.timeout = timeout
+        self._total_slots = threading.BoundedSemaphore(self.total)
+        self._host_slots = {}
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, host):
+        if host not in self._hosts:
+            self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            self._hosts[host] = {"inflight": 0, "queued": 0, "completed": 0, "timeouts": 0}
+        return self._hosts[host], self._host_slots[host]
+
+    @contextmanager
+    def slot(self, host):
+        """占用一个上游空位直到块结束"""
+        with self._lock:
+            entry, host_slots = self._entry(host)
+            entry["queued"] += 1
+        deadline = time.monotonic() + self.timeout
+        acquired = []
+        try:
+            for sem in (self._total_slots, host_slots):
+                if not sem.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                    with self._lock:
+                        entry["timeouts"] += 1
+                    raise UpstreamQueueTimeout(f"等待上游空位超时 ({self.timeout}s)")
+                acquired.append(sem)
+        finally:
+            with self._lock:
+                entry["queued"] -= 1
+                if len(acquired) == 2:
+                    entry["inflight"] += 1
+            if len(acquired) < 2:
+                for sem in acquired:
+                    sem.release()
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry["inflight"] -= 1
+                entry["completed"] += 1
+            host_slots.release()
+            self._total_slots.release()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "limit": self.total,
+                "per_host_limit": self.per_host,
+                "inflight": sum(e["inflight"] for e in self._hosts.values()),
+                "hosts": {host: dict(e) for host, e in self._hosts.items()},
+            }
+
+
+def start_web_server(port=8765, workers=WEB_SERVER_WORKERS, max_inflight=WEB_MAX_INFLIGHT,
+                     cache_ttl=PROXY_CACHE_TTL, host_max_inflight=WEB_HOST_MAX_INFLIGHT,
+                     queue_timeout=WEB_QUEUE_TIMEOUT, run_workers=DEFAULT_TEST_WORKERS):
     """启动本地 Web 代理服务器，为 HTML 版提供 CORS 代理功能。
     浏览器页面通过 /api/proxy?url=<目标URL> 发起请求，
-    服务器转发至实际 API 并返回结果，绕过浏览器 CORS 限制。"""
+    服务器转发至实际 API 并返回结果，绕过浏览器 CORS 限制。
+    请求由 workers 个线程并发处理，同时转发到上游的请求不超过 max_inflight 个，
+    同一主机不超过 host_max_inflight 个，排队超过 queue_timeout 秒返回 503；
+    成功的 GET 响应 (模型列表、余额等) 缓存 cache_ttl 秒，0 表示不缓存。
+    GET /api/stats 返回连接池、上游并发、缓存的实时统计；
+    POST /api/run 在服务端以 run_workers 个线程运行完整测试流程并以 SSE 推送结果。"""
     from http.server import HTTPServer, BaseHTTPRequestHandler
     from urllib.parse import urlparse, parse_qs, unquote
     import webbrowser
@@ -1750,6 +4106,35 @@ def start_web_server(port=8765):
     # 创建独立的 requests 会话（自动继承系统代理）
     web_session = requests.Session()
     web_session.verify = False
+    html_asset = StaticAsset(html_path)
+    web_stats = ConnectionStats()
+    configure_session(web_session, pool_size=host_max_inflight, stats=web_stats)
+    upstream = UpstreamLimiter(max_inflight, host_max_inflight, queue_timeout)
+    proxy_cache = ProxyResponseCache(default_ttl=cache_ttl) if cache_ttl > 0 else None
+    inflight_gets = SingleFlight()
+
+    class PooledHTTPServer(HTTPServer):
+        """用有界线程池处理请求的 HTTPServer：最多并发处理 workers 个连接，其余排队等待"""
+
+        def __init__(self, server_address, handler_class):
+            super().__init__(server_address, handler_class)
+            self._pool = ThreadPoolExecutor(max_workers=max(1, workers),
+                                            thread_name_prefix="web")
+
+        def process_request(self, request, client_address):
+            self._pool.submit(self._process_request_thread, request, client_address)
+
+        def _process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+        def server_close(self):
+            super().server_close()
+            self._pool.shutdown(wait=False, cancel_futures=True)
 
     class ProxyHandler(BaseHTTPRequestHandler):
 
@@ -1757,6 +4142,7 @@ def start_web_server(port=8765):
             """处理 CORS 预检请求"""
             self.send_response(200)
             self._cors_headers()
+            self.send_header("Content-Length", "0")
             self.end_headers()
 
         def do_GET(self):
@@ -1764,12 +4150,16 @@ def start_web_server(port=8765):
                 self._serve_html()
             elif self.path.startswith("/api/proxy"):
                 self._handle_proxy("GET")
+            elif self.path.startswith("/api/stats"):
+                self._serve_stats()
             else:
                 self.send_error(404)
 
         def do_POST(self):
             if self.path.startswith("/api/proxy"):
                 self._handle_proxy("POST")
+            elif self.path.startswith("/api/run"):
+                self._handle_run()
             else:
                 self.send_error(404)
 
@@ -1780,11 +4170,26 @@ def start_web_server(port=8765):
             self.send_header("Access-Control-Expose-Headers", "*")
 
         def _serve_html(self):
+            """返回内存中缓存的 index.html：ETag 未变时回复 304，否则按浏览器支持发送压缩版本"""
             try:
-                with open(html_path, "rb") as f:
-                    content = f.read()
+                etag, variants = html_asset.load()
+                if etag in (self.headers.get("If-None-Match") or ""):
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Cache-Control", "no-cache")
+                    self.end_headers()
+                    return
+                encoding = negotiate_encoding(self.headers.get("Accept-Encoding"))
+                if encoding not in variants:
+                    encoding = None
+                content = variants[encoding]
                 self.send_response(200)
                 self.send_header("Content-Type", "text/html; charset=utf-8")
+                if encoding:
+                    self.send_header("Content-Encoding", encoding)
+                self.send_header("Vary", "Accept-Encoding")
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache")
                 self.send_header("Content-Length", str(len(content)))
                 self.end_headers()
                 self.wfile.write(content)
@@ -1812,6 +4217,26 @@ def start_web_server(port=8765):
             content_length = int(self.headers.get("Content-Length", 0))
             body = self.rfile.read(content_length) if content_length > 0 else None
 
+            # GET 先查缓存 (浏览器发送 Cache-Control: no-cache 时强制回源)
+            cache_key = flight = None
+            if method == "GET":
+                cache_key = ProxyResponseCache.make_key(target_url, self.headers)
+                no_cache = "no-cache" in (self.headers.get("Cache-Control") or "").lower()
+                if proxy_cache is not None and not no_cache:
+                    cached = proxy_cache.get(cache_key)
+                    if cached is not None:
+                        self._send_cached(*cached)
+                        return
+
+                # 相同 URL + 认证的并发 GET 只回源一次，其余请求等待并共享结果
+                leader, flight = inflight_gets.join(cache_key)
+                if not leader:
+                    shared = inflight_gets.wait(flight)
+                    if shared is not None:
+                        self._send_cached(*shared, time.time(), label="COALESCED")
+                        return
+                    flight = None  # leader 失败或响应过大无法共享，自行回源
+
             # 转发请求头（过滤浏览器专用头）
             skip_headers = {
                 "host", "connection", "accept-encoding", "origin",
@@ -1824,31 +4249,21 @@ def start_web_server(port=8765):
                 if key.lower() not in skip_headers:
                     forward_headers[key] = self.headers[key]
 
-            # 转发请求
+            # 转发请求 (受总并发与单主机并发限制，超出时排队等待空位)
+            # 以流式方式读取上游响应，逐块转发给浏览器，SSE 可实时到达且内存占用恒定
             try:
-                if method == "POST":
-                    resp = web_session.post(
-                        target_url, headers=forward_headers,
-                        data=body, timeout=30)
-                else:
-                    resp = web_session.get(
-                        target_url, headers=forward_headers, timeout=30)
-
-                # 返回响应
-                self.send_response(resp.status_code)
-                self._cors_headers()
-
-                # 转发响应头（保留 rate-limit 等关键头）
-                skip_resp = {"content-encoding", "transfer-encoding",
-                             "connection", "content-length"}
-                for key, value in resp.headers.items():
-                    if key.lower() not in skip_resp:
-                        self.send_header(key, value)
-
-                resp_body = resp.content
-                self.send_header("Content-Length", str(len(resp_body)))
-                self.end_headers()
-                self.wfile.write(resp_body)
+                with upstream.slot(urlparse(target_url).netloc):
+                    if method == "POST":
+                        resp = web_session.post(
+                            target_url, headers=forward_headers,
+                            data=body, timeout=30, stream=True)
+                    else:
+                        resp = web_session.get(
+                            target_url, headers=forward_headers, timeout=30, stream=True)
+                    try:
+                        self._stream_response(resp, cache_key, flight)
+                    finally:
+                        resp.close()
 
             except requests.exceptions.ProxyError as e:
                 self._send_proxy_error(f"代理连接失败: {e}")
@@ -1856,11 +4271,186 @@ def start_web_server(port=8765):
                 self._send_proxy_error(f"无法连接目标服务器: {e}")
             except requests.exceptions.Timeout:
                 self._send_proxy_error("请求超时 (30s)")
+            except UpstreamQueueTimeout as e:
+                self._send_proxy_error(f"代理繁忙，{e}", status=503)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 浏览器已断开 (例如关闭页面)，放弃剩余数据
             except Exception as e:
                 self._send_proxy_error(f"代理请求异常: {e}")
+            finally:
+                if flight is not None:
+                    inflight_gets.resolve(cache_key, flight, None)
+
+        def _stream_response(self, resp, cache_key=None, flight=None):
+            """转发状态码与响应头，再逐块写出响应体。
+            上游未压缩且给出 Content-Length 时原样透传长度；
+            否则 (分块、SSE 或已被 requests 解压) 改用 HTTP/1.1 分块传输编码。
+            响应可缓存或有等待中的合并请求 (flight) 时，边转发边收集响应体，
+            完成后写入缓存并交给跟随者。
+            较大的 JSON 响应 (如模型列表) 在浏览器支持时以 gzip 流式压缩后发送。"""
+            length = resp.headers.get("Content-Length")
+            chunked = length is None or "Content-Encoding" in resp.headers
+            compressor = None
+            if ("json" in resp.headers.get("Content-Type", "")
+                    and (chunked or int(length) >= WEB_COMPRESS_MIN)
+                    and negotiate_encoding(self.headers.get("Accept-Encoding"), allow_br=False)):
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip 格式
+                chunked = True
+            if chunked:
+                self.protocol_version = "HTTP/1.1"
+
+            self.send_response(resp.status_code)
+            self._cors_headers()
+
+            # 转发响应头（保留 rate-limit 等关键头）
+            skip_resp = {"content-encoding", "transfer-encoding",
+                         "connection", "content-length"}
+            headers = [(k, v) for k, v in resp.headers.items() if k.lower() not in skip_resp]
+            for key, value in headers:
+                self.send_header(key, value)
+
+            ttl = 0
+            if cache_key is not None and proxy_cache is not None:
+                self.send_header("X-Proxy-Cache", "MISS")
+                if resp.status_code == 200:
+                    ttl = proxy_cache.ttl_for(resp.headers.get("Cache-Control"))
+            captured, captured_size = ([], 0) if ttl or flight else (None, 0)
+            if compressor is not None:
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Vary", "Accept-Encoding")
+            if chunked:
+                self.send_header("Transfer-Encoding", "chunked")
+                self.send_header("Connection", "close")
+            else:
+                self.send_header("Content-Length", length)
+            self.end_headers()
+            self._headers_sent = True
+
+            def write(chunk):
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                    if not chunk:
+                        return
+                if chunked:
+                    self.wfile.write(b"%X\r\n%s\r\n" % (len(chunk), chunk))
+                else:
+                    self.wfile.write(chunk)
+
+            # 需要缓存时暂扣最后一块，先写入缓存再发完，浏览器紧接着的请求即可命中
+            held = None
+            for chunk in resp.iter_content(chunk_size=PROXY_CHUNK_SIZE):
+                if not chunk:
+                    continue
+                if captured is not None:
+                    captured_size += len(chunk)
+                    if captured_size > PROXY_CACHE_MAX_BODY:
+                        captured = None  # 过大，放弃缓存
+                    else:
+                        captured.append(chunk)
+                if held is not None:
+                    write(held)
+                    held = None
+                if captured is not None:
+                    held = chunk
+                else:
+                    write(chunk)
+            if captured is not None:
+                body = b"".join(captured)
+                if ttl:
+                    proxy_cache.put(cache_key, resp.status_code, headers, body, ttl)
+                if flight is not None:
+                    inflight_gets.resolve(cache_key, flight, (resp.status_code, headers, body))
+            if held is not None:
+                write(held)
+            if compressor is not None:
+                tail = compressor.flush()
+                self.wfile.write(b"%X\r\n%s\r\n" % (len(tail), tail))
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+
+        def _send_cached(self, status, headers, body, stored_at, label="HIT"):
+            """直接用缓存 (或合并请求共享) 的响应回复浏览器，较大的 JSON 按浏览器支持压缩"""
+            encoding = None
+            content_type = next((v for k, v in headers if k.lower() == "content-type"), "")
+            if len(body) >= WEB_COMPRESS_MIN and "json" in content_type:
+                encoding = negotiate_encoding(self.headers.get("Accept-Encoding"))
+                if encoding:
+                    body = compress_body(body, encoding)
+            self.send_response(status)
+            self._cors_headers()
+            for key, value in headers:
+                if key.lower() != "age":
+                    self.send_header(key, value)
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+                self.send_header("Vary", "Accept-Encoding")
+            self.send_header("X-Proxy-Cache", label)
+            self.send_header("Age", str(int(time.time() - stored_at)))
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _handle_run(self):
+            """在服务端运行完整测试流水线 (与 CLI 相同的并发引擎)，以 SSE 逐条推送事件。
+            请求体: {"key": 密钥, "url": 可选自定义地址, "bench": 是否做基准测试}"""
+            try:
+                content_length = int(self.headers.get("Content-Length", 0))
+                params = json.loads(self.rfile.read(content_length) or b"{}")
+            except ValueError:
+                params = {}
+            api_key = str(params.get("key") or "").strip()
+            if not api_key:
+                self._send_proxy_error("缺少 key 参数", status=400)
+                return
+            custom_url = str(params.get("url") or "").rstrip("/") or None
+
+            self.send_response(200)
+            self._cors_headers()
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-store")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self._headers_sent = True
+
+            def send_event(record):
+                data = json.dumps(record, ensure_ascii=False)
+                self.wfile.write(f"event: {record['event']}\ndata: {data}\n\n".encode("utf-8"))
 
-        def _send_proxy_error(self, msg):
-            self.send_response(502)
+            try:
+                with capture_events(send_event):
+                    run_key_pipeline(api_key, custom_url, workers=run_workers,
+                                     bench=bool(params.get("bench")))
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 浏览器已断开
+            except Exception as e:
+                try:
+                    send_event({"event": "error", "stage": "unexpected", "message": str(e)})
+                except OSError:
+                    pass
+
+        def _serve_stats(self):
+            """返回连接池复用、上游并发排队、缓存命中等统计 (JSON)"""
+            stats = {
+                "connections": web_stats.snapshot(),
+                "upstream": upstream.snapshot(),
+                "cache": proxy_cache.snapshot() if proxy_cache is not None else None,
+                "coalesced": inflight_gets.shared,
+            }
+            content = json.dumps(stats, ensure_ascii=False, indent=2).encode("utf-8")
+            self.send_response(200)
+            self._cors_headers()
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Cache-Control", "no-store")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def _send_proxy_error(self, msg, status=502):
+            if getattr(self, "_headers_sent", False):
+                # 响应头已发出 (流式转发中途失败)，只能断开连接让浏览器感知错误
+                self.close_connection = True
+                return
+            self.send_response(status)
             self._cors_headers()
             self.send_header("Content-Type", "application/json")
             err_body = json.dumps(
@@ -1878,10 +4468,13 @@ def start_web_server(port=8765):
                 sys.stdout.write(f"\r  📡 {method} → {status}    \n")
                 sys.stdout.flush()
 
+    # /api/run 在服务端直接发请求，与 CLI 一样使用检测到的本地代理
+    configure_session_proxy()
+
     # 尝试启动服务器
     for p in (port, port + 1, port + 2):
         try:
-            server = HTTPServer(("127.0.0.1", p), ProxyHandler)
+            server = PooledHTTPServer(("127.0.0.1", p), ProxyHandler)
             port = p
             break
         except OSError:
@@ -1898,6 +4491,9 @@ def start_web_server(port=8765):
     print()
     print(c(f"  🔗 访问地址: {url}", C.CYAN + C.BOLD))
     print(c(f"  📡 代理模式: 所有 API 请求将通过本地服务器中转，绕过 CORS 限制", C.GRAY))
+    print(c(f"  🧵 并发处理: {workers} 个工作线程，最多 {max_inflight} 个上游请求同时进行 "
+            f"(单主机 {host_max_inflight} 个)", C.GRAY))
+    print(c(f"  📊 运行统计: {url}/api/stats", C.GRAY))
     print(c(f"  🛑 按 Ctrl+C 停止服务", C.GRAY))
     print()
     divider()
@@ -1915,43 +4511,131 @@ def start_web_server(port=8765):
 
 # ─── 主流程 ──────────────────────────────────────────────────
 
+# 需要跟一个参数值的命令行选项，其余 -- 开头的选项视为开关
+CLI_VALUE_OPTIONS = {"--workers", "--rate", "--keys-file", "--concurrency", "--pool-size",
+                     "--bench-tokens", "--load-probe", "--load-max", "--load-seconds",
+                     "--web-workers", "--max-inflight", "--cache-ttl", "--host-max-inflight",
+                     "--queue-timeout", "--since", "--max-age", "--db", "--days"}
+
+
+def parse_cli_args(argv):
+    """解析命令行参数，返回 (位置参数列表, 选项字典)。
+    例: ["KEY", "--workers", "16", "--web"] → (["KEY"], {"--workers": "16", "--web": True})"""
+    positional, options = [], {}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg.startswith("--"):
+            name, eq, value = arg.partition("=")
+            if eq:
+                options[name] = value
+            elif name in CLI_VALUE_OPTIONS and i + 1 < len(argv) and not argv[i + 1].startswith("--"):
+                options[name] = argv[i + 1]
+                i += 1
+            else:
+                options[name] = True
+        else:
+            positional.append(arg)
+        i += 1
+    return positional, options
+
+
+def cli_number(options, name, default, cast=int):
+    """读取数值型选项，格式错误时回退至默认值"""
+    try:
+        return cast(options[name]) if name in options else default
+    except (TypeError, ValueError):
+        print(c(f"  ⚠️  选项 {name} 的值无效，使用默认值 {default}", C.YELLOW))
+        return default
+
+
 def main():
+    args, options = parse_cli_args(sys.argv[1:])
+
+    # 无头模式 (--json-stream 隐含 --headless)
+    if options.get("--headless") or options.get("--json-stream"):
+        enable_headless(json_stream=bool(options.get("--json-stream")))
+
     # 检查 --web 启动模式
-    if "--web" in sys.argv:
+    if options.get("--web"):
         print_header()
-        start_web_server()
+        start_web_server(workers=cli_number(options, "--web-workers", WEB_SERVER_WORKERS),
+                         max_inflight=cli_number(options, "--max-inflight", WEB_MAX_INFLIGHT),
+                         cache_ttl=cli_number(options, "--cache-ttl", PROXY_CACHE_TTL),
+                         host_max_inflight=cli_number(options, "--host-max-inflight",
+                                                      WEB_HOST_MAX_INFLIGHT),
+                         queue_timeout=cli_number(options, "--queue-timeout",
+                                                  WEB_QUEUE_TIMEOUT, float),
+                         run_workers=cli_number(options, "--workers", DEFAULT_TEST_WORKERS))
         return
 
     print_header()
 
+    workers = cli_number(options, "--workers", DEFAULT_TEST_WORKERS)
+    rate = cli_number(options, "--rate", None, float)
+    use_cache = not options.get("--no-cache")
+    db_path = options["--db"] if isinstance(options.get("--db"), str) else RESULTS_DB_FILE
+
+    # trends 子命令：查询本地结果库中的可用性趋势
+    if args and args[0] == "trends":
+        print_trends(args[1] if len(args) > 1 else None,
+                     cli_number(options, "--days", TRENDS_DAYS), db_path)
+        safe_exit(0)
+    configure_session(_session, cli_number(options, "--pool-size", DEFAULT_POOL_SIZE),
+                      pool_block=bool(options.get("--pool-block")),
+                      http2=bool(options.get("--http2")))
+
+    # 批量审计模式
+    if options.get("--keys-file") is True:
+        # 未给出路径 (或紧跟另一个 -- 选项)：不能回退到交互式单密钥流程
+        print(c("  ❌ --keys-file 需要指定密钥文件路径", C.RED))
+        emit_event("error", stage="input", message="--keys-file 缺少文件路径")
+        safe_exit(1)
+    if isinstance(options.get("--keys-file"), str):
+        since = options.get("--since")
+        if since and since != "last":
+            # 导出文件只记录密钥前 8 位，无法可靠地对应到多个密钥
+            print(c("  ❌ 批量模式的增量复测只支持 --since last (基于结果库)", C.RED))
+            safe_exit(1)
+        concurrency = cli_number(options, "--concurrency", DEFAULT_BATCH_CONCURRENCY)
+        stored, filename = run_batch_audit(options["--keys-file"], use_cache, workers, rate,
+                                           concurrency, db_path,
+                                           bool(options.get("--export-json")), bool(since),
+                                           cli_number(options, "--max-age",
+                                                      SINCE_MAX_AGE_HOURS, float))
+        if stored:
+            print(c(f"  💾 审计结果已保存到结果库: {db_path}", C.GREEN))
+            emit_event("store", db=db_path)
+        if filename:
+            print(c(f"  💾 批量审计报告已导出到: {filename}", C.GREEN))
+            emit_event("export", file=filename)
+        print_connection_stats()
+        safe_exit(0)
+
     # ① 获取 API 密钥
-    if len(sys.argv) > 1:
-        api_key = sys.argv[1]
+    if args:
+        api_key = args[0]
         print(c(f"  🔑 API 密钥: {api_key[:8]}...{api_key[-4:]}", C.WHITE))
     else:
-        api_key = input(c("  🔑 请输入 API 密钥: ", C.BOLD + C.WHITE)).strip()
+        api_key = ask(c("  🔑 请输入 API 密钥: ", C.BOLD + C.WHITE)).strip()
 
     if not api_key:
         print(c("\n  ❌ 未输入密钥，退出。\n", C.RED))
+        emit_event("error", stage="input", message="未输入密钥")
         safe_exit(1)
 
-    custom_url = sys.argv[2].rstrip("/") if len(sys.argv) > 2 else None
+    custom_url = args[1].rstrip("/") if len(args) > 1 else None
+    emit_event("start", key_prefix=api_key[:8], custom_url=custom_url)
 
     # ② 提前配置代理（探测服务商时需要）
-    proxy_port, proxy_name = detect_proxy()
-    if proxy_port:
-        px = f"http://127.0.0.1:{proxy_port}"
-        _session.proxies = {"http": px, "https": px}
-        _session.trust_env = False
-    else:
-        sys_proxies = urllib.request.getproxies()
-        if sys_proxies:
-            _session.trust_env = True
+    proxy_port, proxy_name = configure_session_proxy()
 
     # ③ 自动识别 API 服务商
-    provider = auto_detect_provider(api_key, custom_url)
+    provider = auto_detect_provider(api_key, custom_url, use_cache)
     api_format = provider["format"]
     base_url = provider["base_url"]
+    emit_event("provider", name=provider["name"], base_url=base_url, format=api_format,
+               cached=bool(provider.get("_cached")))
 
     # ④ 网络诊断
     if api_format == FORMAT_GEMINI:
@@ -1964,50 +4648,106 @@ def main():
 
     try:
         t0 = time.time()
-        if api_format == FORMAT_GEMINI:
-            models = fetch_models(base_url, api_key)
-        else:
-            models = openai_fetch_models(base_url, api_key, provider["name"])
+        try:
+            if api_format == FORMAT_GEMINI:
+                models = fetch_models(base_url, api_key)
+            else:
+                models = openai_fetch_models(base_url, api_key, provider["name"])
+        except PermissionError:
+            if not provider.get("_cached"):
+                raise
+            # 缓存的服务商已不认此密钥 → 清除缓存，重新探测
+            invalidate_cached_provider(api_key)
+            print(c("  ⚠️  缓存的服务商认证失败，已清除识别缓存，重新探测...", C.YELLOW))
+            provider = auto_detect_provider(api_key, custom_url, use_cache=False)
+            api_format = provider["format"]
+            base_url = provider["base_url"]
+            emit_event("provider", name=provider["name"], base_url=base_url, format=api_format,
+                       cached=False)
+            # 重新探测可能得到 Gemini，按格式获取模型 (Gemini 同样先做网络诊断)
+            if api_format == FORMAT_GEMINI:
+                base_url = run_network_diagnostic(base_url)
+            print(c("  ⏳ 正在获取模型列表...", C.CYAN))
+            t0 = time.time()
+            if api_format == FORMAT_GEMINI:
+                models = fetch_models(base_url, api_key)
+            else:
+                models = openai_fetch_models(base_url, api_key, provider["name"])
         t_fetch = time.time() - t0
     except PermissionError as e:
         print(c(f"\n  ❌ {e}", C.RED))
         print(c("     请确认密钥是否正确", C.YELLOW))
+        emit_event("error", stage="models", message=str(e))
         safe_exit(1)
     except ConnectionError as e:
         print(c(f"\n  ❌ {e}", C.RED))
         print(c("     网络连接出现问题，请参考上方诊断结果排查", C.YELLOW))
+        emit_event("error", stage="models", message=str(e))
         safe_exit(1)
     except Exception as e:
         print(c(f"\n  ❌ {e}", C.RED))
+        emit_event("error", stage="models", message=str(e))
         safe_exit(1)
 
+    emit_event("models", count=len(models), seconds=round(t_fetch, 3),
+               names=[m.get("name") for m in models])
     if not models:
         print(c("  ⚠️  密钥有效，但未找到任何可用模型。", C.YELLOW))
         safe_exit(0)
 
     print(c(f"  ✅ 发现 {len(models)} 个模型 ({t_fetch:.1f}s)", C.GREEN + C.BOLD))
 
-    # ⑥ 逐一测试模型可用性（带进度条）
+    # 增量复测 (--since 上次导出.json | last)：只测新模型、临时性失败与过期结果
+    to_test, carried, carried_at, previous = models, {}, {}, None
+    if options.get("--since") == "last":
+        previous = load_last_run(api_key, db_path)
+    elif isinstance(options.get("--since"), str):
+        previous = load_previous_results(options["--since"], api_key)
+    if previous is not None:
+        to_test, carried, carried_at, reasons = plan_incremental_tests(
+            models, previous, cli_number(options, "--max-age", SINCE_MAX_AGE_HOURS, float))
+        print(c(f"  ♻️  增量复测: 新模型 {reasons['new']} 个, 临时性失败 {reasons['transient']} 个, "
+                f"过期 {reasons['stale']} 个需要测试，沿用 {reasons['carried']} 个上次结果",
+                C.CYAN))
+        emit_event("since", file=options["--since"], retest=len(to_test), **reasons)
+
+    # ⑥ 并发测试模型可用性（带进度条）
     print()
-    print(c("  ⏳ 正在逐一测试模型可用性...", C.CYAN))
+    print(c(f"  ⏳ 正在并发测试模型可用性 ({workers} 线程)...", C.CYAN))
     print()
 
-    test_results = {}
+    def on_test_result(done, total, model, result, latency):
+        display = model.get("displayName", model.get("name", "").replace("models/", ""))
+        progress_bar(done, total, label=display)
+        emit_event("model_result", model=model.get("name"), available=result[0],
+                   message=result[1], latency=latency, done=done, total=total)
+
     t0 = time.time()
-    for i, model in enumerate(models, 1):
-        model_name = model.get("name", "")
-        display = model.get("displayName", model_name.replace("models/", ""))
-        progress_bar(i, len(models), label=display)
-        if api_format == FORMAT_GEMINI:
-            result = test_model(base_url, api_key, model)
-        else:
-            result = openai_test_model(base_url, api_key, model)
-        test_results[model_name] = result
-        if i % 5 == 0:
-            time.sleep(0.2)
+    test_latency = carried_latencies(previous, carried) if carried else {}
+    rate_headers = carried_rate_headers(previous, carried) if carried else {}
+    test_status = {name: previous[name]["testResult"].get("status") for name in carried}
+    cancel = CancelToken()
+    test_results = run_model_tests(base_url, api_key, to_test, api_format,
+                                   provider["name"], workers=workers, rate=rate,
+                                   on_result=on_test_result, latencies=test_latency,
+                                   cancel=cancel, rate_headers=rate_headers,
+                                   statuses=test_status)
+    if carried:
+        test_results = {m["name"]: test_results.get(m["name"]) or carried[m["name"]]
+                        for m in models}
     clear_line()
     t_test = time.time() - t0
-    print(c(f"  ✅ 全部测试完成 ({t_test:.1f}s)", C.GREEN + C.BOLD))
+    if cancel.cancelled:
+        skipped = sum(1 for ok, msg in test_results.values()
+                      if ok is None and msg.startswith("已跳过"))
+        print(c(f"  ⚠️  {cancel.reason}，已跳过其余 {skipped} 个模型 ({t_test:.1f}s)",
+                C.YELLOW + C.BOLD))
+    else:
+        print(c(f"  ✅ 全部测试完成 ({t_test:.1f}s)", C.GREEN + C.BOLD))
+    emit_event("tests_done", seconds=round(t_test, 3),
+               available=sum(1 for ok, _ in test_results.values() if ok is True),
+               unavailable=sum(1 for ok, _ in test_results.values() if ok is False),
+               cancelled=cancel.reason or None)
 
     # ⑦ 按系列分组展示
     print()
@@ -2048,7 +4788,7 @@ def main():
         for model in group:
             idx += 1
             result = test_results.get(model.get("name"))
-            print_model_row(model, result, idx)
+            print_model_row(model, result, idx, test_latency.get(model.get("name")))
 
     # ⑧ 统计摘要
     print_summary(models, test_results)
@@ -2057,20 +4797,71 @@ def main():
     balance_info = {}
     if api_format == FORMAT_OPENAI:
         print(c("  ⏳ 正在查询账户余额...", C.CYAN))
-        balance_info = query_openai_balance(base_url, api_key, provider["name"])
+        balance_info = query_openai_balance(base_url, api_key, provider["name"], use_cache)
+        emit_event("balance", **balance_info)
         print_account_diagnosis(provider, api_key, base_url, balance_info,
                                 models, test_results)
 
     # ⑩ 配额限额分析
-    quota_data = fetch_all_quotas(base_url, api_key, models, test_results, api_format)
+    quota_data = fetch_all_quotas(base_url, api_key, models, test_results, api_format,
+                                  provider["name"], cancel, rate_headers)
+    emit_event("quota_done", count=len(quota_data))
+
+    # 负载探测 (--load-probe [模型])：用实测限额替换缺失的响应头数据
+    load_probe = None
+    if options.get("--load-probe"):
+        target = options["--load-probe"]
+        candidates = [m for m in models
+                      if test_results.get(m["name"], (None,))[0] is True
+                      and "generateContent" in m.get("supportedGenerationMethods", [])]
+        if isinstance(target, str):
+            candidates = [m for m in candidates
+                          if target in (m["name"], m["name"].replace("models/", ""),
+                                        m.get("_model_id"))]
+        if candidates:
+            load_probe = run_load_probe(base_url, api_key, candidates[0], api_format,
+                                        cli_number(options, "--load-max", 32),
+                                        cli_number(options, "--load-seconds", LOAD_LEVEL_SECONDS))
+            apply_load_probe_to_quota(load_probe, quota_data)
+            print_load_probe_report(load_probe)
+        else:
+            print(c(f"  ⚠️  未找到可用于负载探测的模型: {target}", C.YELLOW))
+
     if quota_data:
         print_quota_report(quota_data)
+
+    # 流式吞吐基准测试 (--bench)
+    bench_data = {}
+    if options.get("--bench"):
+        bench_tokens = cli_number(options, "--bench-tokens", BENCH_OUTPUT_TOKENS)
+        bench_data = run_benchmarks(base_url, api_key, models, test_results, api_format,
+                                    provider["name"], bench_tokens, rate=rate, cancel=cancel)
+        emit_event("bench_done", count=len(bench_data))
+        print_benchmark_report(bench_data, quota_data)
+
+    if quota_data:
         prompt_token_calculator(quota_data)
 
-    # ⑪ 自动导出
-    filename = export_json(api_key, base_url, models, test_results, quota_data)
-    print(c(f"  💾 测试结果已自动导出到: {filename}", C.GREEN))
-    print()
+    # ⑪ 保存结果：写入本地结果库，--export-json 时另存 JSON 文件
+    # (--since 上次导出.json 时同样导出，供下一次 --since 使用)
+    report = build_export_data(api_key, base_url, models, test_results, quota_data,
+                               test_latency, bench_data, load_probe, carried_at, test_status)
+    report["provider"] = provider["name"]
+    since = options.get("--since")
+    export = bool(options.get("--export-json")) or (isinstance(since, str) and since != "last")
+    try:
+        run_id, = save_reports([(api_key, report)], db_path)
+        print(c(f"  💾 测试结果已保存到结果库: {db_path} (#{run_id})", C.GREEN))
+        emit_event("store", db=db_path, run_id=run_id)
+    except (sqlite3.Error, OSError) as e:
+        print(c(f"  ⚠️  无法写入结果库 ({e})，改为导出 JSON", C.YELLOW))
+        export = True
+    if export:
+        filename = export_json(api_key, base_url, models, test_results, quota_data,
+                               test_latency, bench_data, load_probe, carried_at, test_status)
+        print(c(f"  💾 测试结果已导出到: {filename}", C.GREEN))
+        emit_event("export", file=filename)
+    print_connection_stats()
 
     # ⑫ 完成
     print(c("  ✅ 全部测试流程完成！", C.GREEN + C.BOLD))
@@ -2087,6 +4878,7 @@ if __name__ == "__main__":
         raise  # 允许 safe_exit() 正常退出
     except Exception as e:
         print(c(f"\n  ❌ 程序发生意外错误: {e}", C.RED))
+        emit_event("error", stage="unexpected", message=str(e))
         import traceback
         traceback.print_exc()
         safe_exit(1)